@@ -308,12 +308,12 @@ class SimpleActionAgent(Agent):
             #               update base on observation            #
             #######################################################
 
-            self.history_steps.append({"step_idx": len(env.trace.steps), "action": entries, "observation": observation})
+            self.history_steps.append({"step_idx": env.num_steps, "action": entries, "observation": observation})
 
             with open(os.path.join(self.log_dir , "main_log"), "a", 1) as f:
                 f.write("\n```\n" + self.history_steps[-1]["observation"] + "\n```\n\n")
 
-            step_idx = len(env.trace.steps) - 1
+            step_idx = env.num_steps - 1
             self.save(os.path.join(self.log_dir , f"agent_{step_idx}_{curr_step}.json"))
 
         return "Finished successfully"
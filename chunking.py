@@ -0,0 +1,81 @@
+""" This file contains the token-aware chunker that splits files into segments for the LLM. """
+
+import io
+import functools
+from dataclasses import dataclass
+import tiktoken
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(name="cl100k_base"):
+    """ Load a tiktoken encoding once per process. """
+    return tiktoken.get_encoding(name)
+
+def count_tokens(text):
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+
+@dataclass(frozen=True)
+class Chunk:
+    text: str
+    start_line: int  # 1-based, inclusive
+    end_line: int  # 1-based, inclusive
+    start_char: int  # 0-based offset in the file, inclusive
+    end_char: int  # 0-based offset in the file, exclusive
+
+
+def iter_chunks(lines, max_tokens=2500, overlap_tokens=0, token_counter=count_tokens):
+    """ Group lines into chunks of at most max_tokens tokens, in a single pass.
+
+    lines is any iterable of lines with their line endings (e.g. an open file, which is then read lazily).
+    Each line is tokenized once. Consecutive chunks share up to overlap_tokens tokens of trailing lines.
+    A line longer than max_tokens is split into roughly equal character slices on its own.
+    """
+    buffer = []  # (line, tokens, line_number, char_offset)
+    buffer_tokens = 0
+    char_offset = 0
+
+    def make_chunk(entries):
+        text = "".join(e[0] for e in entries)
+        return Chunk(text, entries[0][2], entries[-1][2], entries[0][3], entries[0][3] + len(text))
+
+    for line_number, line in enumerate(lines, start=1):
+        tokens = token_counter(line)
+
+        if tokens > max_tokens:
+            if buffer:
+                yield make_chunk(buffer)
+                buffer, buffer_tokens = [], 0
+            pieces = -(-tokens // max_tokens)
+            size = -(-len(line) // pieces)
+            for i in range(0, len(line), size):
+                yield Chunk(line[i:i+size], line_number, line_number, char_offset + i, char_offset + min(i + size, len(line)))
+            char_offset += len(line)
+            continue
+
+        if buffer and buffer_tokens + tokens > max_tokens:
+            yield make_chunk(buffer)
+            # keep the trailing lines that fit in overlap_tokens (and leave room for the current line)
+            kept, kept_tokens = [], 0
+            for entry in reversed(buffer):
+                if kept_tokens + entry[1] > min(overlap_tokens, max_tokens - tokens):
+                    break
+                kept.append(entry)
+                kept_tokens += entry[1]
+            buffer, buffer_tokens = kept[::-1], kept_tokens
+
+        buffer.append((line, tokens, line_number, char_offset))
+        buffer_tokens += tokens
+        char_offset += len(line)
+
+    if buffer:
+        yield make_chunk(buffer)
+
+def chunk_text(text, **kwargs):
+    """ Chunk an in-memory string; see iter_chunks. """
+    return list(iter_chunks(io.StringIO(text, newline=""), **kwargs))
+
+def chunk_file(path, encoding="utf-8", **kwargs):
+    """ Lazily chunk a file without loading it fully into memory; see iter_chunks. """
+    with open(path, encoding=encoding, errors="replace", newline="") as f:
+        yield from iter_chunks(f, **kwargs)
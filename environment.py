@@ -14,12 +14,15 @@ import signal
 import traceback
 from traceback import format_exception
 from multiprocessing import active_children
+from argparse import Namespace
 import readline # to make sure input() works properly
 from dacite import from_dict
 
 from .low_level_actions import LOW_LEVEL_ACTIONS
 from .high_level_actions import HIGH_LEVEL_ACTIONS
-from .schema import Step, Trace, EnvException, TooLongPromptError, LLMError, EnhancedJSONEncoder 
+from .snapshot import SnapshotStore
+from .trace_journal import TraceJournal, read_trace, compact
+from .schema import Action, Step, Trace, trace_view, ObservationStore, EnvException, TooLongPromptError, LLMError
 # from .LLM import complete_text_claude  # Removed for Gemini-only setup
 # from .prepare_task import prepare_task, get_task_info  # Removed for deployment
 
@@ -86,6 +89,12 @@ class Environment:
             "research_problem": self.research_problem,
         }
         self._trace = self._initialize_trace()
+        # kept up to date by execute, so that is_final does not have to scan the trace
+        self._num_steps = len(self._trace.steps)
+        self._final_answer = any(s.action.name == "Final Answer" for s in self._trace.steps)
+        self._journal = TraceJournal(os.path.join(self.log_dir, "trace.jsonl"))
+        self._journal.sync(self._trace)
+        self._snapshots = SnapshotStore(os.path.join(self.log_dir, "snapshots"), tree_root=os.path.join(self.log_dir, "traces"))
         self._start_time = time.time()
 
     ############################## getters ########################################
@@ -124,7 +133,18 @@ class Environment:
     
     @property
     def trace(self):
-        return copy.deepcopy(self._trace)
+        """ A read-only view of the trace; it is not a copy, so it reflects steps taken after it was obtained. """
+        return trace_view(self._trace)
+
+    @property
+    def recording_trace(self):
+        """ The trace itself, to pass as trace= to actions called outside of execute() so that their low level steps are
+        recorded (and journaled on the next save). Everyone else should use the read-only trace. """
+        return self._trace
+
+    @property
+    def num_steps(self):
+        return self._num_steps
 
     @property
     def start_time(self):
@@ -165,9 +185,15 @@ class Environment:
         os.mkdir(os.path.join(work_dir, "backup"))
         if self.args.resume:
             shutil.rmtree(work_dir)
-            resume_dir = os.path.join(self.args.resume, "env_log", "traces" , f"step_{self.args.resume_step}_files")
-            print("Restoring workspace ing from {}".format(resume_dir))
-            shutil.copytree(resume_dir, work_dir, symlinks=True)
+            snapshots = SnapshotStore(os.path.join(self.args.resume, "env_log", "snapshots"))
+            if snapshots.has(self.args.resume_step):
+                print("Restoring workspace from snapshot {} of {}".format(self.args.resume_step, snapshots.root))
+                snapshots.materialize(self.args.resume_step, work_dir)
+            else:
+                # runs saved before the snapshot store only have a full copy per step
+                resume_dir = os.path.join(self.args.resume, "env_log", "traces" , f"step_{self.args.resume_step}_files")
+                print("Restoring workspace ing from {}".format(resume_dir))
+                shutil.copytree(resume_dir, work_dir, symlinks=True)
             if not os.path.exists(os.path.join(work_dir, "backup")):
                 os.mkdir(os.path.join(work_dir, "backup"))
 
@@ -205,7 +231,13 @@ class Environment:
 
 
     def _initialize_trace(self):
-        if self.args.resume:
+        # observations of this environment, spilled (see OBSERVATION_SPILL_BYTES) under its own log dir
+        observations = ObservationStore(os.path.join(self.log_dir, "observations"))
+        journal_path = os.path.join(self.args.resume, "env_log", "trace.jsonl") if self.args.resume else None
+        if journal_path and os.path.exists(journal_path):
+            print("Restoring trace from {} up to step {}".format(journal_path, self.args.resume_step))
+            trace = read_trace(journal_path, self.action_infos, self.research_problem, last_step=self.args.resume_step, observations=observations)
+        elif self.args.resume:
             print("Restoring trace from {}".format(self.args.resume))
             prev_trace = from_dict(data_class=Trace, data=json.load(open(os.path.join(self.args.resume, "env_log","trace.json"), "r")))
             print("Resetting trace to step {}".format(self.args.resume_step))
@@ -217,6 +249,7 @@ class Environment:
                 low_level_steps=low_level_steps,
                 action_infos=self.action_infos,
                 task_description=self.research_problem,
+                observations=observations,
             )
         else:   
             trace = Trace(
@@ -224,6 +257,7 @@ class Environment:
             low_level_steps=[],
             action_infos=self.action_infos,
             task_description=self.research_problem,
+            observations=observations,
         )
         return trace
     
@@ -245,6 +279,15 @@ class Environment:
         active = active_children()
         print(f'Active Children: {len(active)}')
             
+        # leave a readable trace.json behind even if the run did not reach save("final")
+        try:
+            self.compact_trace()
+        except Exception as e:
+            print(f"Warning: could not write trace.json: {e}")
+        finally:
+            self._journal.close()
+            self._trace.observations.close()
+
         if traceback is not None:
             print("Error message saved in error.txt")
             open(os.path.join(self.log_dir, "error.txt"), "w").write(''.join(format_exception(exc_type, exc_value, traceback)))
@@ -255,10 +298,7 @@ class Environment:
     def is_final(self):
         """Check if the task has reached a final state, either by reaching the maximum steps or time, or because the agent has submitted a final answer. """
         
-        curr_step = len(self.trace.steps)
-        # check if any step is final answer
-        any_final_answer = any([s.action.name == "Final Answer" for s in self.trace.steps])
-        return curr_step >= self.args.max_steps or any_final_answer or time.time() - self.start_time > self.args.max_time
+        return self._num_steps >= self.args.max_steps or self._final_answer or time.time() - self.start_time > self.args.max_time
 
     def execute(self, action):
         """Execute an action and return the observation."""
@@ -318,37 +358,34 @@ class Environment:
 
         step_time = time.time()
 
-        trace.steps.append(Step(action, observation, step_time))
+        trace.steps.append(Step(action, trace.observations.intern(observation, spill=False), step_time))
+        self._num_steps = len(trace.steps)
+        self._final_answer = self._final_answer or action_name == "Final Answer"
 
         self.save(curr_step)
         return observation
 
     def save(self, curr_step):
         """ Save the trace and snapshot of the workspace folder """     
-        with open(os.path.join(self.log_dir, f"trace.json"), "w") as f:
-            json.dump(self.trace, f, indent=4, cls=EnhancedJSONEncoder)
+        # only the records added since the last save are appended; trace.json is produced on the final save
+        self._journal.sync(self._trace)
+        if curr_step == "final":
+            self.compact_trace()
+            self._journal.close()
 
         ##### save a snapshot of the current step
-        save_folder = os.path.join(self.log_dir, f"traces/step_{curr_step}_files")
-        if os.path.exists(save_folder):
-            shutil.rmtree(save_folder)
-        os.makedirs(save_folder)
-
-        # save files in the folder that are not read only
-        for path, subdirs, files in os.walk(os.path.join(self.work_dir)):
-
-            relpath = os.path.relpath(path, self.work_dir)
-            dest = os.path.join(save_folder, relpath)
-
-            for file_name in files:
-                file_path = os.path.join(relpath, file_name)
-                if file_path not in self.read_only_files:
-                    # check wether the file to copy is part of self.log_dir
-                    if  os.path.abspath(os.path.join(self.work_dir, file_path)).startswith(os.path.abspath(self.log_dir.split("/env_log")[0])):
-                        continue                    
-                    if not os.path.exists(dest):
-                        os.makedirs(dest)            
-                    shutil.copyfile(os.path.join(self.work_dir, file_path), os.path.join(save_folder, file_path))
+        # files in the folder that are not read only, and not part of self.log_dir
+        log_root = os.path.abspath(self.log_dir.split("/env_log")[0])
+        def include(file_path):
+            if file_path in self.read_only_files:
+                return False
+            return not os.path.abspath(os.path.join(self.work_dir, file_path)).startswith(log_root)
+        self._snapshots.snapshot(self.work_dir, curr_step, include=include)
+
+    def compact_trace(self):
+        """ Write the trace journal out as the legacy trace.json. """
+        self._journal.sync(self._trace)
+        compact(self._journal.path, os.path.join(self.log_dir, "trace.json"))
 
     ############## for logging convenience ##############
 
@@ -364,4 +401,33 @@ class Environment:
         return list(filter(lambda x: not x.is_primitive, self.action_infos.values()))
 
     def print_action(self, entries):
-        return "".join([ k + ": " + v for k,v in  entries.items()])
\ No newline at end of file
+        return "".join([ k + ": " + v for k,v in  entries.items()])
+
+
+def benchmark_step_overhead(run_lengths=(10, 100, 1000), observation_size=20000, repeats=100):
+    """ Time the per-step bookkeeping an agent does (is_final, num_steps, reading the trace) at several run lengths,
+    against the deep copy that the trace property used to make. """
+    env = Environment.__new__(Environment)
+    env._args = Namespace(max_steps=10 ** 9, max_time=10 ** 9)
+    env._start_time = time.time()
+    for length in run_lengths:
+        steps = [Step(Action("Edit Script (AI)", {"script_name": "train.py"}), "x" * observation_size, time.time()) for _ in range(length)]
+        env._trace = Trace(steps=steps, low_level_steps=list(steps), action_infos={}, task_description="")
+        env._num_steps = length
+        env._final_answer = False
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            env.is_final()
+            env.num_steps
+            env.trace.steps[-1]
+        view = (time.perf_counter() - start) / repeats
+        start = time.perf_counter()
+        for _ in range(max(1, repeats // 10)):
+            copy.deepcopy(env._trace)
+        deep_copy = (time.perf_counter() - start) / max(1, repeats // 10)
+        print(f"{length} steps: {view * 1e6:.1f}us/step with views, {deep_copy * 1e6:.0f}us per deep copy")
+
+
+if __name__ == "__main__":
+    benchmark_step_overhead()
@@ -1,14 +1,22 @@
 """ This file contains high level actions that may contain multiple low level actions and LLM calls. """
 
 import os
+import hashlib
+import inspect
 import datetime
 import shutil
 import difflib
-import tiktoken
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from .low_level_actions import read_file, write_file, append_file, execute_script
 from .schema import ActionInfo, EnvException
+from . import LLM
 from .LLM import complete_text_fast, complete_text
-from .retrieval import RetrievalDatabase
+from .retrieval import get_retrieval_database
+from .chunking import Chunk, chunk_text, get_encoding
+from .llm_cache import CompletionCache
+from .preflight import check_files, uses_current_interpreter
+from .patching import PATCH_FORMAT_PROMPT, PatchError, parse_search_replace, apply_search_replace, validate_python
 
 def reflection(things_to_reflect_on, work_dir = ".", research_problem = "", **kwargs):
 
@@ -25,15 +33,15 @@ def reflection(things_to_reflect_on, work_dir = ".", research_problem = "", **kw
     reflection = complete_text_fast(prompt, log_file=kwargs["log_file"])
     return f"Reflection: {reflection}\n"
 
+CBR_CASE_DIRS = [
+    "../data/nlp_cases",
+    "../data/tsa_cases",
+    "../data/tabular_cases",
+]
+CBR_EMBEDDING_MODEL = "BAAI/llm-embedder"
 def plan_experiment_design_cbr(experiment_log, **kwargs):
     research_problem = kwargs["research_problem"]
-    retrieval_database = RetrievalDatabase([
-           "../data/nlp_cases",
-           "../data/tsa_cases",
-           "../data/tabular_cases",
-        ],
-        model="BAAI/llm-embedder",
-    )
+    retrieval_database = get_retrieval_database(CBR_CASE_DIRS, model=CBR_EMBEDDING_MODEL)
     query = f"""{research_problem}{experiment_log}"""
     
     try:
@@ -95,83 +103,119 @@ Please carefully reason over this relevant case and the provided research proble
         print(f"Warning: Model completion failed: {str(e)}")
         return "Proceed with basic implementation: Load the data, perform basic preprocessing, and train a simple model to establish a baseline."
 
+SUMMARY_CHUNK_TOKENS = 2500 # maximum number of tokens of a file segment summarized by one LLM call
+SUMMARY_CHUNK_OVERLAP = 0 # tokens of trailing lines repeated at the start of the next segment
+SUMMARY_CONCURRENCY = 8 # maximum number of segment summaries requested from the LLM at the same time
+SUMMARY_REDUCE_FANOUT = 8 # maximum number of segment summaries merged by one LLM call; more are merged as a tree
+SUMMARY_CACHE = CompletionCache() # reuses segment summaries of unchanged chunks across steps; set to None to disable
+def fast_model_name():
+    """ The model complete_text_fast sends prompts to: LLM.FAST_MODEL, which the runners set and complete_text_fast reads,
+    else the default of complete_text_fast's model argument. None if neither is known. """
+    model = getattr(LLM, "FAST_MODEL", None)
+    if model is None:
+        try:
+            parameter = inspect.signature(complete_text_fast).parameters.get("model")
+        except (TypeError, ValueError):
+            parameter = None
+        if parameter is not None and parameter.default is not inspect.Parameter.empty:
+            model = parameter.default
+    return model
+
+def cached_complete_text_fast(prompt, log_file, key=None):
+    """ complete_text_fast, answered from SUMMARY_CACHE when the same prompt (or the same key, if given) was already sent
+    to the same model. Nothing is cached if the model cannot be told, since a key without it would outlive a change of model. """
+    model = fast_model_name()
+    if SUMMARY_CACHE is None or model is None:
+        return complete_text_fast(prompt, log_file=log_file)
+    key = SUMMARY_CACHE.key(model, prompt if key is None else key)
+    completion = SUMMARY_CACHE.get(key)
+    if completion is None:
+        completion = complete_text_fast(prompt, log_file=log_file)
+        SUMMARY_CACHE.put(key, completion)
+    return completion
+
+def _segment_key(segment_prompt, text):
+    """ The cache key of a segment summary: the hash of the chunk text and of the prompt template with the request filled in
+    (segment_prompt of an empty text), so a chunk that moved within its file or to another file is still a hit. """
+    template = hashlib.sha256(segment_prompt("").encode("utf-8", errors="surrogatepass")).hexdigest()
+    text = hashlib.sha256(text.encode("utf-8", errors="surrogatepass")).hexdigest()
+    return f"segment\0{template}\0{text}"
+
+def summarize_segments(content, segment_prompt, merge_prompt, log_file):
+    """ Split content into token-budgeted chunks, summarize them concurrently and merge the summaries in segment order.
+    segment_prompt(text) and merge_prompt(descriptions) build the prompts. A segment is summarized from its text alone, with
+    line numbers counted from the start of the segment, so an unchanged chunk of a file is answered from SUMMARY_CACHE
+    wherever it is in the file; the merge step is given the offsets of each segment in the file. """
+    # an empty file is still described by one (empty) segment
+    chunks = chunk_text(content, max_tokens=SUMMARY_CHUNK_TOKENS, overlap_tokens=SUMMARY_CHUNK_OVERLAP) or [Chunk("", 1, 1, 0, 0)]
+
+    def summarize(idx_chunk):
+        idx, chunk = idx_chunk
+        return cached_complete_text_fast(segment_prompt(chunk.text), log_file=log_file+f"_{idx}", key=_segment_key(segment_prompt, chunk.text))
+
+    def merge(level, group_idx, group):
+        if len(group) == 1:
+            return group[0]
+        prompt = merge_prompt(_join_segments(group, first_idx=group_idx * SUMMARY_REDUCE_FANOUT))
+        span = Chunk("", group[0][1].start_line, group[-1][1].end_line, group[0][1].start_char, group[-1][1].end_char)
+        return cached_complete_text_fast(prompt, log_file=log_file+f"_merge_{level}_{group_idx}"), span, False
+
+    with ThreadPoolExecutor(max_workers=max(1, min(SUMMARY_CONCURRENCY, len(chunks)))) as executor:
+        # map() returns results in submission order, so segment order is preserved.
+        # Each description is (summary, chunk it covers, whether its line numbers are relative to the chunk).
+        descriptions = [(summary, chunk, True) for summary, chunk in zip(executor.map(summarize, enumerate(chunks)), chunks)]
+
+        # Tree reduce: merge groups of SUMMARY_REDUCE_FANOUT summaries until one call can merge the rest.
+        level = 0
+        while len(descriptions) > SUMMARY_REDUCE_FANOUT:
+            groups = [descriptions[i:i+SUMMARY_REDUCE_FANOUT] for i in range(0, len(descriptions), SUMMARY_REDUCE_FANOUT)]
+            futures = [executor.submit(merge, level, group_idx, group) for group_idx, group in enumerate(groups)]
+            descriptions = [f.result() for f in futures]
+            level += 1
+
+    if len(descriptions) == 1:
+        # a single chunk starts at line 1, so its relative line numbers are the file's
+        return descriptions[0][0]
+    return cached_complete_text_fast(merge_prompt(_join_segments(descriptions)), log_file=log_file)
+
+def _join_segments(descriptions, first_idx=0):
+    segments = []
+    for idx, (summary, chunk, relative) in enumerate(descriptions):
+        header = f"Segment {first_idx + idx} (lines {chunk.start_line}-{chunk.end_line}, characters {chunk.start_char}-{chunk.end_char} of the file"
+        if relative and chunk.start_line > 1:
+            header += f"; its line numbers count from the start of the segment, add {chunk.start_line - 1} to get line numbers in the file"
+        segments.append(header + "): \n\n" + summary)
+    return "\n\n".join(segments)
+
 def understand_file(file_name, things_to_look_for, work_dir = ".", **kwargs):
 
-    lines = read_file(file_name, work_dir = work_dir, **kwargs).split("\n")
-    # group lines to blocks so that each block has at most 10000 characters
-    counter = 0
-    blocks = []
-    while counter < len(lines):
-        block = []
-        start_line_number = counter + 1
-        while counter < len(lines) and len("\n".join(block)) + len(lines[counter]) < 10000:
-            block.append(lines[counter])
-            counter += 1
-        if len(block) > 0:
-            end_line_number = counter 
-            blocks.append(("\n".join(block), start_line_number, end_line_number))
-        else:
-            end_line_number = start_line_number
-            # probably a file of one/few very long line; split by 10000 characters
-            for i in range(0, len(lines[counter]), 10000):
-                blocks.append((lines[counter][i:i+10000], start_line_number, end_line_number))
-            counter += 1
-
-    descriptions  = []
-    for idx, (b, start_line_number, end_line_number) in enumerate(blocks):
-        start_char_number = sum([len(b) for b in blocks[:idx]])
-        end_char_number = start_line_number + len(b)
-        prompt = f"""Given this (partial) file from line {start_line_number} character {start_char_number} to line {end_line_number} character {end_char_number}: 
+    content = read_file(file_name, work_dir = work_dir, **kwargs)
+
+    def segment_prompt(text):
+        return f"""Given this (partial) file, whose first line is line 1: 
     ``` 
-    {b}
+    {text}
     ```
     Here is a detailed description on what to look for and what should returned: {things_to_look_for}
     The description should short and also reference crtical lines in the script relevant to what is being looked for. Only describe what is objectively confirmed by the file content. Do not include guessed numbers. If you cannot find the answer to certain parts of the request, you should say "In this segment, I cannot find ...".
     """
 
-        completion = complete_text_fast(prompt, log_file=kwargs["log_file"]+f"_{idx}")
-        descriptions.append(completion)
-    if len(descriptions) == 1:
-        return descriptions[0]
-    else:
-        descriptions = "\n\n".join(["Segment {idx}: \n\n" + s for s in descriptions])
-        prompt = f"""Given the relevant observations for each segments of a file, summarize to get a cohesive description of the entire file on what to look for and what should returned: {things_to_look_for}
+    def merge_prompt(descriptions):
+        return f"""Given the relevant observations for each segments of a file, summarize to get a cohesive description of the entire file on what to look for and what should returned: {things_to_look_for}
+    Refer to lines by their line numbers in the file.
     {descriptions}
     """
 
-        completion = complete_text_fast(prompt, log_file=kwargs["log_file"])
-
-        return completion
+    return summarize_segments(content, segment_prompt, merge_prompt, kwargs["log_file"])
 
 def summary_progress(file_name, work_dir=".", **kwargs):
 
-    lines = read_file(file_name, work_dir=work_dir, **kwargs).split("\n")
-    # group lines to blocks so that each block has at most 10000 characters
-    counter = 0
-    blocks = []
-    while counter < len(lines):
-        block = []
-        start_line_number = counter + 1
-        while counter < len(lines) and len("\n".join(block)) + len(lines[counter]) < 10000:
-            block.append(lines[counter])
-            counter += 1
-        if len(block) > 0:
-            end_line_number = counter 
-            blocks.append(("\n".join(block), start_line_number, end_line_number))
-        else:
-            end_line_number = start_line_number
-            # probably a file of one/few very long line; split by 10000 characters
-            for i in range(0, len(lines[counter]), 10000):
-                blocks.append((lines[counter][i:i+10000], start_line_number, end_line_number))
-            counter += 1
-
-    descriptions  = []
-    for idx, (b, start_line_number, end_line_number) in enumerate(blocks):
-        start_char_number = sum([len(b) for b in blocks[:idx]])
-        end_char_number = start_line_number + len(b)
-        prompt = f"""Given this (partial) file from line {start_line_number} character {start_char_number} to line {end_line_number} character {end_char_number}: 
+    content = read_file(file_name, work_dir=work_dir, **kwargs)
+
+    def segment_prompt(text):
+        return f"""Given this (partial) file, whose first line is line 1: 
     ``` 
-    {b}
+    {text}
     ```
     Based on this file, please give a summary on the current progress on this research problem: 
     ```
@@ -180,32 +224,52 @@ def summary_progress(file_name, work_dir=".", **kwargs):
     The description should short and also reference crtical lines in the script relevant to what is being looked for. Only describe what is objectively confirmed by the file content. Do not include guessed numbers. If you cannot find the answer to certain parts of the request, you should say "In this segment, I cannot find ...".
     """
 
-        completion = complete_text_fast(prompt, log_file=kwargs["log_file"]+f"_{idx}")
-        descriptions.append(completion)
-    if len(descriptions) == 1:
-        return descriptions[0]
-    else:
-        descriptions = "\n\n".join(["Segment {idx}: \n\n" + s for s in descriptions])
-        prompt = f"""Given the relevant observations for each segments of a file, please give a summary on the current progress on this research problem: {kwargs['research_problem']}
+    def merge_prompt(descriptions):
+        return f"""Given the relevant observations for each segments of a file, please give a summary on the current progress on this research problem: {kwargs['research_problem']}
+    Refer to lines by their line numbers in the file.
     {descriptions}
     """
 
-        completion = complete_text_fast(prompt, log_file=kwargs["log_file"])
-
-        return completion
+    return summarize_segments(content, segment_prompt, merge_prompt, kwargs["log_file"])
 
 
 EDIT_SCRIPT_MODEL = "models/gemini-2.0-flash"
 EDIT_SCRIPT_MAX_TOKENS = 4000
+EDIT_SCRIPT_MODE = "full" # "full": the model re-emits the whole script; "patch": the model returns search/replace hunks; "auto": patch for non-empty scripts, falling back to full
 def edit_script(script_name, edit_instruction, save_name, work_dir = ".", **kwargs):
-    #TODO: handle long file editing
     try:
         content = read_file(script_name, work_dir = work_dir, **kwargs)
     except:
         write_file(script_name, "", work_dir = work_dir, **kwargs)
         content = ""
-        
-    prompt = f"""Given this python script:
+
+    new_content = None
+    if EDIT_SCRIPT_MODE == "patch" or (EDIT_SCRIPT_MODE == "auto" and content.strip()):
+        prompt = f"""Given this python script:
+    ```python 
+    {content}
+    ```
+    Edit the script by following the instruction:
+    {edit_instruction}
+    {PATCH_FORMAT_PROMPT}
+    Your codes will be executed with the support of a NVIDIA GPU card with 24 GB memory.
+    """
+        completion = complete_text(prompt, log_file=kwargs["log_file"], model=EDIT_SCRIPT_MODEL, max_tokens=EDIT_SCRIPT_MAX_TOKENS)
+        try:
+            hunks = parse_search_replace(completion)
+            if not hunks:
+                raise PatchError("No search/replace block found in the response.")
+            new_content = apply_search_replace(content, hunks)
+            if save_name.endswith(".py"):
+                validate_python(new_content, save_name)
+        except PatchError as e:
+            if EDIT_SCRIPT_MODE == "patch":
+                raise EnvException(f"The edit of {script_name} could not be applied: {e}")
+            print(f"Warning: patch edit failed, regenerating the full script: {e}")
+            new_content = None
+
+    if new_content is None:
+        prompt = f"""Given this python script:
     ```python 
     {content}
     ```
@@ -214,11 +278,11 @@ def edit_script(script_name, edit_instruction, save_name, work_dir = ".", **kwar
     Note that you should provide and only provide the **full** code after the edit, making no other changes. Start the python code with "```python". Please ensure the completeness of the codes so that it can be run without additional modifications.
     Your codes will be executed with the support of a NVIDIA GPU card with 24 GB memory.
     """
-    ##### Edit the prompt to make sure the coding completeness
+        ##### Edit the prompt to make sure the coding completeness
 
-    completion = complete_text(prompt, log_file=kwargs["log_file"], model=EDIT_SCRIPT_MODEL, max_tokens=EDIT_SCRIPT_MAX_TOKENS)
+        completion = complete_text(prompt, log_file=kwargs["log_file"], model=EDIT_SCRIPT_MODEL, max_tokens=EDIT_SCRIPT_MAX_TOKENS)
 
-    new_content = completion.split("```python")[1].split("```")[0].strip()
+        new_content = completion.split("```python")[1].split("```")[0].strip()
 
     # backup all old file with prefix script_name
     backup_name = os.path.join(work_dir,"backup", f"{script_name}_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}")
@@ -231,11 +295,146 @@ def edit_script(script_name, edit_instruction, save_name, work_dir = ".", **kwar
 
     return f"The edited file is saved to {save_name}. Here is the diff, please check if the edit is correct and desirable:\n\n" + diff
 
+EXECUTION_OBSERVATION_MAX_TOKENS = 2000
+EXECUTION_OBSERVATION_HEAD_TOKENS = 0 # tokens kept from the start of a long execution log (e.g. the first error), out of EXECUTION_OBSERVATION_MAX_TOKENS
+def truncate_observation(observation, max_tokens=None, head_tokens=None):
+    """ Keep the last max_tokens tokens of observation (and optionally its first head_tokens tokens), encoding it only once. """
+    max_tokens = EXECUTION_OBSERVATION_MAX_TOKENS if max_tokens is None else max_tokens
+    head_tokens = EXECUTION_OBSERVATION_HEAD_TOKENS if head_tokens is None else head_tokens
+    enc = get_encoding()
+    tokens = enc.encode(observation, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return observation
+    head_tokens = min(head_tokens, max_tokens)
+    tail = enc.decode(tokens[len(tokens) - (max_tokens - head_tokens):]) if max_tokens > head_tokens else ""
+    if head_tokens == 0:
+        return tail
+    return enc.decode(tokens[:head_tokens]) + f"\n...[{len(tokens) - max_tokens} tokens truncated]...\n" + tail
+
+EXECUTE_NUM_CANDIDATES = 1 # candidate scripts sampled and run in parallel per Programmer/Debugger round; 1 keeps the sequential loop
+def parse_code_files(completion, save_name):
+    """ Return {file path: code} for the ```python blocks of completion; an untitled block is save_name. """
+    files_to_write = {}
+    current_file = None
+    current_content = []
+    
+    for line in completion.split('\n'):
+        if line.startswith('```python:'):
+            if current_file and current_content:
+                files_to_write[current_file] = '\n'.join(current_content)
+            current_file = line.split(':', 1)[1].strip()
+            current_content = []
+        elif line.startswith('```python'):
+            if current_file and current_content:
+                files_to_write[current_file] = '\n'.join(current_content)
+            current_file = save_name
+            current_content = []
+        elif line.startswith('```'):
+            if current_file and current_content:
+                files_to_write[current_file] = '\n'.join(current_content)
+            current_file = None
+            current_content = []
+        elif current_file is not None:
+            current_content.append(line)
+    return files_to_write
+
+EXECUTE_PREFLIGHT = True # compile generated files and resolve their imports before running them
+def run_preflight(files_to_write, experiment_dir, save_name, **kwargs):
+    """ Return the pre-flight check failures of files_to_write as a Debugger observation, or "" if they may be run. """
+    if not EXECUTE_PREFLIGHT:
+        return ""
+    python = kwargs.get("python", "python")
+    # installed packages can only be inspected for the interpreter running the agent
+    errors = check_files(files_to_write, experiment_dir, save_name, check_imports=uses_current_interpreter(python))
+    if not errors:
+        return ""
+    print(f"Pre-flight checks failed:\n{errors}")
+    return "The script was not run because it failed the pre-flight checks:\n" + errors
+
+def execution_succeeded(observation):
+    return "Traceback (most recent call last):" not in observation and "SyntaxError: invalid syntax" not in observation
+
+def run_candidate(index, prompt, save_name, experiment_dir, stop_event, **kwargs):
+    """ Sample one candidate program, write it to experiment_dir/candidates/candidate_<index> and run it there.
+    Returns (candidate_dir, files_to_write, observation, succeeded), or None if no code was produced or stop_event was set.
+    Candidates differ only through the sampling of the LLM backend with its default settings. """
+    # each candidate logs its LLM calls and script output to files of its own
+    kwargs = dict(kwargs, log_file=kwargs["log_file"] + f"_candidate_{index}")
+    candidate_dir = os.path.join(experiment_dir, "candidates", f"candidate_{index}")
+    # start from a clean directory each round, so files of an earlier round cannot end up in a winner's copy-back
+    shutil.rmtree(candidate_dir, ignore_errors=True)
+    for name in os.listdir(experiment_dir):
+        if name == "candidates" or not os.path.isdir(os.path.join(experiment_dir, name)):
+            continue
+        target = os.path.join(candidate_dir, name)
+        if name == "data":
+            # input data is shared by all candidates rather than copied
+            os.makedirs(candidate_dir, exist_ok=True)
+            if not os.path.lexists(target):
+                os.symlink(os.path.abspath(os.path.join(experiment_dir, name)), target)
+        else:
+            os.makedirs(target, exist_ok=True)
+
+    files_to_write = {}
+    for _ in range(5):
+        if stop_event.is_set():
+            return None
+        try:
+            completion = complete_text(prompt, log_file=kwargs["log_file"], model=EDIT_SCRIPT_MODEL, max_tokens=EDIT_SCRIPT_MAX_TOKENS)
+        except Exception as e:
+            print(f"Error in model completion for candidate {index}: {str(e)}")
+            continue
+        files_to_write = parse_code_files(completion, save_name)
+        if files_to_write:
+            break
+        print(f"Warning: No valid Python code found in response for candidate {index}")
+    if not files_to_write or stop_event.is_set():
+        return None
+
+    for file_path, code in files_to_write.items():
+        write_file(file_path, code, work_dir=candidate_dir, **kwargs)
+    preflight_log = run_preflight(files_to_write, candidate_dir, save_name, **kwargs)
+    if preflight_log:
+        return candidate_dir, files_to_write, preflight_log, False
+    try:
+        observation = execute_script(save_name, work_dir=candidate_dir, stop_event=stop_event, **kwargs)
+        observation = truncate_observation(observation)
+    except Exception as e:
+        observation = f"Error: {str(e)}"
+    return candidate_dir, files_to_write, observation, execution_succeeded(observation)
+
+def run_candidates(prompt, save_name, experiment_dir, num_candidates, **kwargs):
+    """ Run num_candidates run_candidate calls concurrently (the scripts themselves are separate processes) and return
+    the first successful result, or (None, failed results in completion order). Runs still in progress when a candidate
+    succeeds are cancelled, and waited for, so that none of them records low level steps after this returns. """
+    stop_event = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=num_candidates)
+    futures = [pool.submit(run_candidate, i, prompt, save_name, experiment_dir, stop_event, **kwargs) for i in range(num_candidates)]
+    failures = []
+    try:
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error in candidate: {str(e)}")
+                continue
+            if result is None:
+                continue
+            if result[3]:
+                return result, failures
+            failures.append(result)
+        return None, failures
+    finally:
+        stop_event.set()
+        # stop_event kills running scripts and stops candidates between LLM calls, so this does not wait long
+        pool.shutdown(wait=True, cancel_futures=True)
+
 def execute(script_name, plan, save_name, work_dir = ".", **kwargs):
     """
     In DS-Agent, we execute the experiment plan via cooperation between Programmer and Debugger.
     """
     max_iteration = 5
+    num_candidates = kwargs.pop("num_candidates", EXECUTE_NUM_CANDIDATES)
     
     # Create a unique experiment folder with timestamp
     timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -334,6 +533,26 @@ For large projects, you can split the code into multiple files. If you need to c
 
 Your response must start with ```python and end with ```. Do not include any other text or explanations.
 """
+        if num_candidates > 1:
+            winner, failures = run_candidates(prompt, save_name, experiment_dir, num_candidates, **kwargs)
+            if winner is not None:
+                candidate_dir, files_to_write, observation, _ = winner
+                # keep the winning candidate's code and outputs at the usual place in the experiment folder
+                shutil.copytree(candidate_dir, experiment_dir, symlinks=True, dirs_exist_ok=True,
+                                ignore=lambda d, names: ["data"] if os.path.samefile(d, candidate_dir) else [])
+                execution_log = f"The instructions have been performed ({os.path.basename(candidate_dir)} of {num_candidates} parallel candidates). Here is the result log:\n" + observation
+                diff = list(difflib.unified_diff(content.splitlines(keepends=True), files_to_write.get(save_name, "").splitlines(keepends=True)))
+                diff = "".join(diff)
+                return execution_log, diff
+            if not failures:
+                execution_log = f"The instruction cannot be perfectly performed by another Python programming Agent in {num_candidates} parallel attempts. Please give a more simplified and feasible instruction and retry."
+                return execution_log, None
+            # Else: the Debugger revises the first candidate that finished.
+            _, files_to_write, observation, _ = failures[0]
+            last_content = files_to_write.get(save_name, "")
+            iteration += 1
+            continue
+
         max_retry = 0
         while max_retry < 5:
             max_retry += 1
@@ -341,28 +560,7 @@ Your response must start with ```python and end with ```. Do not include any oth
                 completion = complete_text(prompt, log_file=kwargs["log_file"], model=EDIT_SCRIPT_MODEL, max_tokens=EDIT_SCRIPT_MAX_TOKENS)
                 
                 # Handle multiple files in the response
-                files_to_write = {}
-                current_file = None
-                current_content = []
-                
-                for line in completion.split('\n'):
-                    if line.startswith('```python:'):
-                        if current_file and current_content:
-                            files_to_write[current_file] = '\n'.join(current_content)
-                        current_file = line.split(':', 1)[1].strip()
-                        current_content = []
-                    elif line.startswith('```python'):
-                        if current_file and current_content:
-                            files_to_write[current_file] = '\n'.join(current_content)
-                        current_file = save_name
-                        current_content = []
-                    elif line.startswith('```'):
-                        if current_file and current_content:
-                            files_to_write[current_file] = '\n'.join(current_content)
-                        current_file = None
-                        current_content = []
-                    elif current_file is not None:
-                        current_content.append(line)
+                files_to_write = parse_code_files(completion, save_name)
                 
                 if not files_to_write:
                     print("Warning: No valid Python code found in response")
@@ -394,21 +592,22 @@ Your response must start with ```python and end with ```. Do not include any oth
             except Exception as e:
                 print(f"Warning: Could not create backup for {file_path}: {str(e)}")
         
-        # Execute the main script
-        try:
-            observation = execute_script(save_name, work_dir=experiment_dir, **kwargs)
-            ## If observation is too long, we only keep the last ~2k tokens.
-            enc = tiktoken.get_encoding("cl100k_base")
-            tokens = len(enc.encode(observation))
-            while tokens >= 2000:
-                observation = observation[2000:]
-                tokens = len(enc.encode(observation))
-        except Exception as e:
-            print(f"Error executing script: {str(e)}")
-            observation = f"Error: {str(e)}"
+        # Check the generated files first; a broken script goes straight back to the Debugger
+        observation = run_preflight(files_to_write, experiment_dir, save_name, **kwargs)
+        succeeded = False
+        if not observation:
+            # Execute the main script
+            try:
+                observation = execute_script(save_name, work_dir=experiment_dir, **kwargs)
+                ## If observation is too long, we only keep the last ~2k tokens.
+                observation = truncate_observation(observation)
+            except Exception as e:
+                print(f"Error executing script: {str(e)}")
+                observation = f"Error: {str(e)}"
+            succeeded = execution_succeeded(observation)
         
         # If the script has been successfully executed: Exit.
-        if "Traceback (most recent call last):" not in observation and "SyntaxError: invalid syntax" not in observation:
+        if succeeded:
             execution_log = "The instructions have been performed. Here is the result log:\n" + observation
             diff = list(difflib.unified_diff(content.splitlines(keepends=True), new_content.splitlines(keepends=True)))
             diff = "".join(diff)
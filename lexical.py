@@ -0,0 +1,77 @@
+""" This file contains the lexical (BM25) scorer used next to dense embeddings to retrieve and rerank cases. """
+
+import re
+import math
+from collections import Counter
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_]+")
+
+def tokenize(text):
+    """ Lower-cased alphanumeric terms, so that names such as LightGBM, roc_auc or MAPE match exactly. """
+    return [t.lower() for t in TOKEN_PATTERN.findall(text)]
+
+
+class BM25:
+    """ Okapi BM25 over an inverted index (term -> postings of (document id, term frequency)). """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        doc_len = []
+        for doc_id, document in enumerate(documents):
+            terms = tokenize(document)
+            doc_len.append(len(terms))
+            for term, tf in Counter(terms).items():
+                self.postings.setdefault(term, []).append((doc_id, tf))
+        self.doc_len = np.array(doc_len, dtype=np.float32)
+        self.avgdl = float(self.doc_len.mean()) if len(doc_len) else 0.0
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def to_dict(self):
+        return {"k1": self.k1, "b": self.b, "doc_len": self.doc_len.tolist(), "postings": self.postings}
+
+    @classmethod
+    def from_dict(cls, data):
+        bm25 = cls([], k1=data["k1"], b=data["b"])
+        bm25.postings = {term: [tuple(p) for p in postings] for term, postings in data["postings"].items()}
+        bm25.doc_len = np.array(data["doc_len"], dtype=np.float32)
+        bm25.avgdl = float(bm25.doc_len.mean()) if len(bm25.doc_len) else 0.0
+        return bm25
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self) - df + 0.5) / (df + 0.5))
+
+    def scores(self, query):
+        """ BM25 score of query against every document, as an array of length len(self). """
+        scores = np.zeros(len(self), dtype=np.float32)
+        if not len(self):
+            return scores
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / max(self.avgdl, 1e-9))
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            doc_ids = np.fromiter((d for d, _ in postings), dtype=np.int64, count=len(postings))
+            tf = np.fromiter((f for _, f in postings), dtype=np.float32, count=len(postings))
+            scores[doc_ids] += self.idf(term) * tf * (self.k1 + 1) / (tf + norm[doc_ids])
+        return scores
+
+
+def min_max_normalize(scores):
+    scores = np.asarray(scores, dtype=np.float32)
+    if scores.size == 0:
+        return scores
+    spread = scores.max() - scores.min()
+    if spread <= 0:
+        return np.zeros_like(scores)
+    return (scores - scores.min()) / spread
+
+
+def fuse_scores(dense, lexical, lexical_weight=0.5):
+    """ Convex combination of min-max normalized dense and lexical scores. """
+    return (1 - lexical_weight) * min_max_normalize(dense) + lexical_weight * min_max_normalize(lexical)
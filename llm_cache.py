@@ -0,0 +1,102 @@
+""" This file contains a persistent, content-addressed cache of LLM completions. """
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+LLM_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "mlagentbench", "completions")
+
+
+def evict_lru_files(root, max_bytes, max_age=None):
+    """ Remove the files under root older than max_age seconds (if given), then the least recently used ones (by
+    mtime) until the rest fit in max_bytes. Used by the on-disk caches, which refresh a file's mtime on every hit. """
+    now = time.time()
+    entries = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if max_age is not None and now - st.st_mtime > max_age:
+                _remove(path)
+            else:
+                entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove(path)
+        total -= size
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class CompletionCache:
+    """ Completions stored as one small JSON file per sha256(model, prompt).
+
+    Entries older than max_age seconds are evicted, and when the cache grows beyond max_bytes the least
+    recently used entries (by file mtime, refreshed on every hit) are evicted first.
+    """
+
+    def __init__(self, root=LLM_CACHE_DIR, max_bytes=256 * 1024 * 1024, max_age=30 * 24 * 3600, evict_every=100):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model, prompt):
+        return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8", errors="surrogatepass")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                completion = json.load(f)["completion"]
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                raise FileNotFoundError(path)
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return completion
+
+    def put(self, key, completion):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"completion": completion, "created": time.time()}, f)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """ Remove expired entries, then the least recently used ones until the cache fits in max_bytes. """
+        evict_lru_files(self.root, self.max_bytes, max_age=self.max_age)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
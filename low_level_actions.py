@@ -6,11 +6,16 @@ import selectors
 import shutil
 import glob
 import sys
+import json
+import signal
+import resource
 import inspect
+from collections import deque
 from functools import wraps
 import time
 from io import StringIO
 from .schema import Step, ActionInfo, Action, EnvException
+from .worker_pool import PRELOAD_MODULES, get_worker_pool
 import readline # This is needed to make sure that the input() function works properly
 
 
@@ -28,72 +33,104 @@ def normalize_args_kwargs(f, *args, **kwargs):
     
     return arguments
 
-def append_to_low_level_steps(trace, name, args, observation):
-    """ This function appends a low level step to the trace. """
-    trace.low_level_steps.append(Step(action=Action(name, args),observation=observation,timestamp=time.time()))
-
-
-def record_low_level_step(func):
-    """ This decorator records a low level step in the trace."""
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        new_kwargs = normalize_args_kwargs(func, *args, **kwargs)
-        if "trace" not in new_kwargs:
-            print("Warning: trace not found in kwargs; not recording low level step.")
-            print(func)
-            return func(*args, **kwargs)
-        else:
-            trace = new_kwargs["trace"]
-            for a in LOW_LEVEL_ACTIONS:
-                if a.function.__name__ == func.__name__:
-                    name = a.name
-                    input_args = a.usage.keys()
-                    break
-            new_kwargs = {k: v for k, v in new_kwargs.items() if k in input_args}
-            try:
-                observation = func(*args, **kwargs)
-                append_to_low_level_steps(trace, name, new_kwargs, observation)
-                return observation
-            except EnvironmentError as e:
-                append_to_low_level_steps(trace, name, new_kwargs, e)
-                raise EnvException(e)
-    return wrapper
 
-
-def check_file_read_only(arg_names, **kwargs):
-    """ This decorator checks if the file is read-only. """
-    
+def make_args_binder(f):
+    """ Precompute the signature of f and return bind(args, kwargs), which gives the same dictionary as
+    normalize_args_kwargs(f, *args, **kwargs) without going through inspect on every call. Unusual calls (missing or
+    duplicate arguments, ...) fall back to normalize_args_kwargs, which raises the usual TypeError. """
+    params = list(inspect.signature(f).parameters.values())
+    simple = all(p.kind in (p.POSITIONAL_OR_KEYWORD, p.VAR_KEYWORD) for p in params)
+    has_var_kwargs = any(p.kind == p.VAR_KEYWORD for p in params)
+    names = [p.name for p in params if p.kind == p.POSITIONAL_OR_KEYWORD]
+    name_set = frozenset(names)
+    defaults = {p.name: p.default for p in params if p.default is not p.empty}
+
+    def bind(args, kwargs):
+        if not simple or len(args) > len(names):
+            return normalize_args_kwargs(f, *args, **kwargs)
+        arguments = {}
+        for i, name in enumerate(names):
+            if i < len(args):
+                if name in kwargs:
+                    return normalize_args_kwargs(f, *args, **kwargs)
+                arguments[name] = args[i]
+            elif name in kwargs:
+                arguments[name] = kwargs[name]
+            elif name in defaults:
+                arguments[name] = defaults[name]
+            else:
+                return normalize_args_kwargs(f, *args, **kwargs)
+        for key, value in kwargs.items():
+            if key not in name_set:
+                if not has_var_kwargs:
+                    return normalize_args_kwargs(f, *args, **kwargs)
+                arguments[key] = value
+        return arguments
+    return bind
+
+
+def append_to_low_level_steps(trace, name, args, observation, usage=None):
+    """ This function appends a low level step to the trace, interning the observation in the trace's store if it has one. """
+    if trace.observations is not None:
+        observation = trace.observations.intern(observation)
+    trace.low_level_steps.append(Step(action=Action(name, args),observation=observation,timestamp=time.time(),usage=usage))
+
+
+_ACTION_INFOS_BY_FUNCTION = None
+
+def action_info_of(func):
+    """ The entry of LOW_LEVEL_ACTIONS for func, from a map built on first use (LOW_LEVEL_ACTIONS is defined after the actions). """
+    global _ACTION_INFOS_BY_FUNCTION
+    if _ACTION_INFOS_BY_FUNCTION is None:
+        _ACTION_INFOS_BY_FUNCTION = {a.function.__name__: a for a in LOW_LEVEL_ACTIONS}
+    return _ACTION_INFOS_BY_FUNCTION[func.__name__]
+
+
+def low_level_action(in_work_dir=(), read_only_checked=(), returns_usage=False):
+    """ This decorator checks that the files named by the in_work_dir arguments are in the work directory and that
+    those named by the read_only_checked arguments are not read-only files, then records the call as a low level step
+    in the trace. The arguments are bound once per call, with the signature precomputed here.
+
+    With returns_usage, the action returns (observation, usage); usage is recorded in the step and the observation is
+    returned to the caller. """
     def inner(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            new_kwargs = normalize_args_kwargs(func, *args, **kwargs)
-            for arg_name in arg_names:
-                if "kwargs" in new_kwargs and "read_only_files" in new_kwargs["kwargs"]:
-                    if new_kwargs[arg_name] in new_kwargs["kwargs"]["read_only_files"]:
-                        raise EnvException(f"cannot write file {new_kwargs[arg_name]} because it is a read-only file.")
-            return func(*args, **kwargs)
-        return wrapper
-    return inner
+        bind = make_args_binder(func)
 
-
-def check_file_in_work_dir(arg_names, **kwargs):
-    """ This decorator checks if the file is in the work directory. """
-    def inner(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            new_kwargs = normalize_args_kwargs(func, *args, **kwargs)
-            work_dir = new_kwargs["work_dir"]
-            for arg_name in arg_names:
-                file_name = new_kwargs[arg_name]
-                if not os.path.abspath(os.path.join(work_dir, file_name)).startswith(os.path.abspath(work_dir)):
-                    raise EnvException(f"cannot access file {file_name} because it is not in the work directory.")
-            return func(*args, **kwargs)
+            arguments = bind(args, kwargs)
+            if in_work_dir:
+                work_dir = os.path.abspath(arguments["work_dir"])
+                for arg_name in in_work_dir:
+                    file_name = arguments[arg_name]
+                    if not os.path.abspath(os.path.join(work_dir, file_name)).startswith(work_dir):
+                        raise EnvException(f"cannot access file {file_name} because it is not in the work directory.")
+            read_only_files = arguments.get("read_only_files")
+            if read_only_files:
+                for arg_name in read_only_checked:
+                    if arguments[arg_name] in read_only_files:
+                        raise EnvException(f"cannot write file {arguments[arg_name]} because it is a read-only file.")
+
+            if "trace" not in arguments:
+                print("Warning: trace not found in kwargs; not recording low level step.")
+                print(func)
+                observation = func(*args, **kwargs)
+                return observation[0] if returns_usage else observation
+            trace = arguments["trace"]
+            info = action_info_of(func)
+            step_args = {k: v for k, v in arguments.items() if k in info.usage}
+            try:
+                observation, usage = func(*args, **kwargs) if returns_usage else (func(*args, **kwargs), None)
+                append_to_low_level_steps(trace, info.name, step_args, observation, usage)
+                return observation
+            except EnvironmentError as e:
+                append_to_low_level_steps(trace, info.name, step_args, e)
+                raise EnvException(e)
         return wrapper
     return inner
 
 
-@check_file_in_work_dir(["dir_path"])
-@record_low_level_step
+@low_level_action(in_work_dir=["dir_path"])
 def list_files( dir_path, work_dir = ".", **kwargs):
     try:
         observation = subprocess.check_output(["ls", "-F", os.path.join(work_dir,dir_path)]).decode("utf-8")
@@ -105,8 +142,7 @@ def list_files( dir_path, work_dir = ".", **kwargs):
 
 
 
-@check_file_in_work_dir(["file_name"])
-@record_low_level_step
+@low_level_action(in_work_dir=["file_name"])
 def read_file(file_name, work_dir = '.', **kwargs):
     try:
         observation = open(os.path.join(work_dir,file_name)).read()
@@ -115,9 +151,7 @@ def read_file(file_name, work_dir = '.', **kwargs):
         raise EnvException(f"cannot read file {file_name}")
 
 
-@check_file_in_work_dir(["file_name"])
-@check_file_read_only(["file_name"])
-@record_low_level_step
+@low_level_action(in_work_dir=["file_name"], read_only_checked=["file_name"])
 def write_file(file_name, content, work_dir = ".", **kwargs):
     try:
         # Ensure the directory exists
@@ -134,9 +168,7 @@ def write_file(file_name, content, work_dir = ".", **kwargs):
         raise EnvException(f"cannot write file {file_name}")
 
 
-@check_file_in_work_dir(["file_name"])
-@check_file_read_only(["file_name"])
-@record_low_level_step
+@low_level_action(in_work_dir=["file_name"], read_only_checked=["file_name"])
 def append_file(file_name, content, work_dir = ".", **kwargs):
     try:
         with open(os.path.join(work_dir,file_name), "a") as f:
@@ -147,9 +179,7 @@ def append_file(file_name, content, work_dir = ".", **kwargs):
         raise EnvException(f"cannot append file {file_name}")
 
 
-@check_file_in_work_dir(["source", "destination"])
-@check_file_read_only(["destination"])
-@record_low_level_step
+@low_level_action(in_work_dir=["source", "destination"], read_only_checked=["destination"])
 def copy_file( source, destination, work_dir = ".", **kwargs):
     
     try:
@@ -160,8 +190,7 @@ def copy_file( source, destination, work_dir = ".", **kwargs):
         raise EnvException(f"File {source} copy to {destination} failed. Check whether the source and destinations are valid.")
 
 
-@check_file_in_work_dir(["script_name"])
-@record_low_level_step
+@low_level_action(in_work_dir=["script_name"])
 def undo_edit_script( script_name, work_dir = ".", **kwargs):
     
     backup_files = glob.glob(os.path.join(work_dir,"backup", f"{script_name}_*"))
@@ -182,8 +211,215 @@ def undo_edit_script( script_name, work_dir = ".", **kwargs):
         )
 
 
-@check_file_in_work_dir(["script_name"])
-@record_low_level_step
+EXECUTE_TIMEOUT = None # wall-clock limit in seconds for execute_script; None means no limit
+EXECUTE_IDLE_TIMEOUT = None # limit in seconds on a script producing no output at all; None means no limit
+EXECUTE_OUTPUT_TAIL_BYTES = 64 * 1024 # bytes of stdout and of stderr kept in memory; the full output goes to the log file
+EXECUTE_MEMORY_LIMIT_MB = None # address space limit of the script process in MB; None means no limit
+EXECUTE_CPU_TIME_LIMIT = None # CPU time limit in seconds (the script gets SIGXCPU, then SIGKILL a second later); None means no limit
+EXECUTE_MAX_OPEN_FILES = None # limit on open file descriptors of the script; None means no limit
+EXECUTE_WORKER_POOL = False # run scripts in forked children of a pre-warmed interpreter (see worker_pool.py) instead of a fresh one
+EXECUTE_POOL_PRELOAD = PRELOAD_MODULES # modules imported once by the pre-warmed interpreter
+EXECUTE_NUM_THREADS = None # thread count exported as OMP_NUM_THREADS and friends to the script; None leaves the environment alone
+THREAD_LIMIT_ENV_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "TORCH_NUM_THREADS"]
+
+
+class TailBuffer:
+    """ Keeps the last max_bytes bytes written to it. """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.chunks = deque()
+        self.size = 0
+        self.dropped = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.size - len(self.chunks[0]) >= self.max_bytes:
+            chunk = self.chunks.popleft()
+            self.size -= len(chunk)
+            self.dropped += len(chunk)
+
+    def getvalue(self):
+        data = b"".join(self.chunks)
+        extra = max(0, len(data) - self.max_bytes)
+        self.dropped += extra
+        self.chunks = deque([data[extra:]])
+        self.size = len(data) - extra
+        return data[extra:].decode("utf-8", errors="replace")
+
+
+def rlimits(memory_limit_mb=None, cpu_time_limit=None, max_open_files=None):
+    """ Return the (resource, soft, hard) limits to set for the given values. """
+    limits = []
+    if memory_limit_mb is not None:
+        limits.append((resource.RLIMIT_AS, int(memory_limit_mb * 1024 * 1024), int(memory_limit_mb * 1024 * 1024)))
+    if cpu_time_limit is not None:
+        limits.append((resource.RLIMIT_CPU, int(cpu_time_limit), int(cpu_time_limit) + 1))
+    if max_open_files is not None:
+        limits.append((resource.RLIMIT_NOFILE, int(max_open_files), int(max_open_files)))
+    return limits
+
+
+def thread_limit_env(num_threads=None):
+    """ Return the environment variables that cap the thread pools of common numeric libraries. """
+    if num_threads is None:
+        return {}
+    return {name: str(num_threads) for name in THREAD_LIMIT_ENV_VARS}
+
+
+# Sets the rlimits given as JSON in argv[1], then execs argv[2:]. rlimits are applied this way rather than with
+# Popen(preexec_fn=...), which is not safe when other threads are running (execute_script runs in parallel candidates).
+RLIMIT_WRAPPER = "import os, sys, json, resource\nfor limit, soft, hard in json.loads(sys.argv[1]): resource.setrlimit(limit, (soft, hard))\nos.execvp(sys.argv[2], sys.argv[2:])"
+
+def resource_limits(memory_limit_mb=None, cpu_time_limit=None, max_open_files=None, num_threads=None):
+    """ Return (prefix, env) that apply the given limits to a child process: the command prefix that sets the rlimits
+    before exec'ing the command ([] if there are none), and the environment (None if it is unchanged). """
+    limits = rlimits(memory_limit_mb, cpu_time_limit, max_open_files)
+    prefix = [sys.executable, "-I", "-S", "-c", RLIMIT_WRAPPER, json.dumps(limits)] if limits else []
+
+    env = None
+    if num_threads is not None:
+        env = dict(os.environ)
+        env.update(thread_limit_env(num_threads))
+    return prefix, env
+
+
+def format_resource_usage(usage):
+    """ One-line summary of the usage dict returned by run_streaming. """
+    line = f"Resource usage: peak RSS {usage['max_rss_mb']:.1f} MB, user CPU {usage['user_time']:.2f}s, system CPU {usage['system_time']:.2f}s, wall time {usage['wall_time']:.2f}s"
+    if usage.get("signal"):
+        line += f", terminated by {usage['signal']}"
+    return line
+
+
+def run_streaming(cmd, cwd, log_path=None, timeout=None, idle_timeout=None, tail_bytes=EXECUTE_OUTPUT_TAIL_BYTES, stop_event=None, spawn=None, **popen_kwargs):
+    """ Run cmd, reading stdout and stderr incrementally. Both streams are teed in arrival order to log_path, and only the
+    last tail_bytes of each are kept in memory. If the process runs longer than timeout seconds, or prints nothing for
+    idle_timeout seconds, its whole process group is killed. The same happens soon after stop_event (a threading.Event) is set.
+
+    Returns a dict with returncode, stdout, stderr (the tails), stdout_dropped/stderr_dropped (bytes not kept), timed_out
+    (None, "wall", "idle" or "cancelled"), wall_time and usage (peak RSS and CPU times of the process from wait4).
+
+    spawn, if given, is called instead of subprocess.Popen to start the process; see worker_pool.PooledProcess. """
+    start = time.monotonic()
+    if spawn is not None:
+        process = spawn()
+    else:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd, start_new_session=True, **popen_kwargs)
+    tails = {"stdout": TailBuffer(tail_bytes), "stderr": TailBuffer(tail_bytes)}
+    log = open(log_path, "wb") if log_path else None
+    timed_out = None
+    last_output = start
+    with selectors.DefaultSelector() as selector:
+        selector.register(process.stdout, selectors.EVENT_READ, "stdout")
+        selector.register(process.stderr, selectors.EVENT_READ, "stderr")
+        try:
+            while selector.get_map():
+                now = time.monotonic()
+                waits = []
+                if timeout is not None:
+                    waits.append(start + timeout - now)
+                if idle_timeout is not None:
+                    waits.append(last_output + idle_timeout - now)
+                if waits and min(waits) <= 0:
+                    timed_out = "wall" if timeout is not None and now - start >= timeout else "idle"
+                    break
+                if stop_event is not None:
+                    if stop_event.is_set():
+                        timed_out = "cancelled"
+                        break
+                    waits.append(0.1)
+                for key, _ in selector.select(timeout=min(waits) if waits else None):
+                    data = os.read(key.fd, 65536)
+                    if not data:
+                        selector.unregister(key.fileobj)
+                        continue
+                    tails[key.data].write(data)
+                    if log:
+                        log.write(data)
+                    last_output = time.monotonic()
+        finally:
+            if log:
+                log.close()
+    if timed_out:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    if spawn is not None:
+        status, rusage = process.wait_with_usage()
+    else:
+        _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall_time = time.monotonic() - start
+    process.stdout.close()
+    process.stderr.close()
+    usage = {
+        "max_rss_mb": rusage.ru_maxrss / 1024, # ru_maxrss is in KB on Linux
+        "user_time": rusage.ru_utime,
+        "system_time": rusage.ru_stime,
+        "wall_time": wall_time,
+        "signal": signal.Signals(-process.returncode).name if process.returncode < 0 else None,
+    }
+
+    stdout, stderr = tails["stdout"].getvalue(), tails["stderr"].getvalue()
+    return {
+        "returncode": process.returncode,
+        "stdout": stdout,
+        "stderr": stderr,
+        "stdout_dropped": tails["stdout"].dropped,
+        "stderr_dropped": tails["stderr"].dropped,
+        "timed_out": timed_out,
+        "wall_time": wall_time,
+        "usage": usage,
+    }
+
+
+def execution_log_path(script_path, log_file=None):
+    """ Where the full output of script_path is written: a new file <log_file>_<script name>[_<n>].log if the environment
+    gave a log file for the step, else next to the script. Every run within a step (the Debugger iterations of an
+    Execute the Experiment Plan, say) gets its own file, so an observation never points at the output of a later run. """
+    if not log_file:
+        return os.path.abspath(script_path) + ".log"
+    base = os.path.abspath(f"{log_file}_{os.path.basename(script_path)}")
+    n = 0
+    while True:
+        path = f"{base}_{n}.log" if n else f"{base}.log"
+        try:
+            # claim the name atomically; runs of parallel candidates have log files of their own anyway
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return path
+        except FileExistsError:
+            n += 1
+
+
+def format_execution_output(result, log_path=None):
+    """ Build the execute_script observation from a run_streaming result. """
+    def tail(name):
+        text = result[name]
+        if result[f"{name}_dropped"]:
+            where = f", full output in {log_path}" if log_path else ""
+            text = f"[... {result[f'{name}_dropped']} bytes of {name} omitted{where} ...]\n" + text
+        return text
+
+    usage = "\n" + format_resource_usage(result["usage"]) if result.get("usage") else ""
+    if result["timed_out"]:
+        reason = {
+            "wall": "ran longer than the time limit",
+            "idle": "produced no output within the idle time limit",
+            "cancelled": "was cancelled",
+        }[result["timed_out"]]
+        print(f"Script execution killed: it {reason} ({result['wall_time']:.0f}s)")
+        return f"Error: Script execution was killed because it {reason} after {result['wall_time']:.0f} seconds\n" + tail("stdout") + tail("stderr") + usage
+    if result["returncode"] != 0:
+        print(f"Script execution failed with return code: {result['returncode']}")
+        print(f"Error output: {result['stderr']}")
+        return f"Error: Script execution failed\n{tail('stderr')}{usage}"
+    return tail("stdout") + usage
+
+
+@low_level_action(in_work_dir=["script_name"], returns_usage=True)
 def execute_script(script_name, work_dir = ".", **kwargs):
     """Execute a Python script and return its output."""
     try:
@@ -194,7 +430,7 @@ def execute_script(script_name, work_dir = ".", **kwargs):
         # Check if script exists
         if not os.path.exists(script_path):
             print(f"Error: Script file not found: {script_path}")
-            return f"Error: Script file not found: {script_path}"
+            return f"Error: Script file not found: {script_path}", None
             
         # Get Python interpreter
         python = kwargs.get("python", "python")
@@ -208,33 +444,43 @@ def execute_script(script_name, work_dir = ".", **kwargs):
         experiment_dir = os.path.dirname(os.path.abspath(script_path))
         print(f"Experiment directory: {experiment_dir}")
         
-        # Execute the script
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            cwd=experiment_dir  # Use the experiment directory as working directory
+        # Execute the script, streaming its output to a log file next to the step's tool log (env_log/tool_logs),
+        # outside of the workspace so that it is not snapshotted with it
+        log_path = execution_log_path(script_path, kwargs.get("log_file"))
+        limits = dict(
+            memory_limit_mb=kwargs.get("memory_limit_mb", EXECUTE_MEMORY_LIMIT_MB),
+            cpu_time_limit=kwargs.get("cpu_time_limit", EXECUTE_CPU_TIME_LIMIT),
+            max_open_files=kwargs.get("max_open_files", EXECUTE_MAX_OPEN_FILES),
+            num_threads=kwargs.get("num_threads", EXECUTE_NUM_THREADS),
         )
-        
-        # Get output
-        stdout, stderr = process.communicate()
-        
-        # Check return code
-        if process.returncode != 0:
-            print(f"Script execution failed with return code: {process.returncode}")
-            print(f"Error output: {stderr}")
-            return f"Error: Script execution failed\n{stderr}"
-            
-        return stdout
+        prefix, env = resource_limits(**limits)
+        spawn = None
+        if kwargs.get("worker_pool", EXECUTE_WORKER_POOL):
+            pool = get_worker_pool(python, EXECUTE_POOL_PRELOAD)
+            spawn = lambda: pool.spawn(
+                cmd[1], experiment_dir,
+                env=thread_limit_env(limits.pop("num_threads")),
+                rlimits=rlimits(**limits),
+            )
+        result = run_streaming(
+            prefix + cmd,
+            cwd=experiment_dir,  # Use the experiment directory as working directory
+            log_path=log_path,
+            timeout=kwargs.get("timeout", EXECUTE_TIMEOUT),
+            idle_timeout=kwargs.get("idle_timeout", EXECUTE_IDLE_TIMEOUT),
+            env=env,
+            stop_event=kwargs.get("stop_event"),
+            spawn=spawn,
+        )
+        return format_execution_output(result, log_path), result["usage"]
         
     except Exception as e:
         error_msg = f"Error executing script: {str(e)}"
         print(error_msg)
-        return error_msg
+        return error_msg, None
 
 
-@record_low_level_step
+@low_level_action()
 def python_repl(command, work_dir = ".", **kwargs):
     """Run command and returns anything printed."""
     try:
@@ -258,7 +504,7 @@ def python_repl(command, work_dir = ".", **kwargs):
         raise EnvException(f"Something went wrong in executing {command}: {e}")
 
 
-@record_low_level_step
+@low_level_action()
 def request_help(request, work_dir = ".", **kwargs):
     return input(f"Research Assistant is requesting help: {request}\n")
 
@@ -369,4 +615,44 @@ LOW_LEVEL_ACTIONS = [
         function=(lambda **kwargs: ""),
         is_primitive=True
     ),
-]
\ No newline at end of file
+]
+
+
+def benchmark_overhead(calls=20000):
+    """ Compare the per-call overhead of the low_level_action wrapper on read_file with that of the previous stacked
+    decorators, which bound the arguments with inspect three times and scanned LOW_LEVEL_ACTIONS on every call. """
+    from .schema import Trace
+    import tempfile
+
+    raw_read_file = read_file.__wrapped__
+
+    def legacy_read_file(*args, **kwargs):
+        for _ in range(3):
+            arguments = normalize_args_kwargs(raw_read_file, *args, **kwargs)
+        for a in LOW_LEVEL_ACTIONS:
+            if a.function.__name__ == raw_read_file.__name__:
+                break
+        step_args = {k: v for k, v in arguments.items() if k in a.usage}
+        observation = raw_read_file(*args, **kwargs)
+        append_to_low_level_steps(kwargs["trace"], a.name, step_args, observation)
+        return observation
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        with open(os.path.join(work_dir, "train.py"), "w") as f:
+            f.write("print('hello')\n")
+        trace = Trace(steps=[], low_level_steps=[], action_infos={}, task_description="")
+        kwargs = dict(work_dir=work_dir, trace=trace, device=0, python="python", read_only_files=[], log_file="log")
+        timings = {}
+        for label, f in [("undecorated", raw_read_file), ("stacked decorators", legacy_read_file), ("low_level_action", read_file)]:
+            start = time.perf_counter()
+            for _ in range(calls):
+                f("train.py", **kwargs)
+            timings[label] = (time.perf_counter() - start) / calls
+            trace.low_level_steps.clear()
+        for label, seconds in timings.items():
+            overhead = seconds - timings["undecorated"]
+            print(f"{label}: {seconds * 1e6:.1f}us/call ({overhead * 1e6:.1f}us overhead)")
+
+
+if __name__ == "__main__":
+    benchmark_overhead()
@@ -0,0 +1,107 @@
+""" This file contains the search/replace patch format used to edit scripts without regenerating them in full. """
+
+import re
+import difflib
+
+SEARCH_REPLACE_PATTERN = re.compile(
+    r"^<{5,9} ?SEARCH[^\n]*\n(.*?)^={5,9}[^\n]*\n(.*?)^>{5,9} ?REPLACE[^\n]*$",
+    re.DOTALL | re.MULTILINE,
+)
+FUZZY_MATCH_THRESHOLD = 0.9
+FUZZY_MATCH_MIN_LINES = 3 # shorter SEARCH blocks must match exactly or up to whitespace
+FUZZY_MATCH_MARGIN = 0.02 # a fuzzy match is ambiguous if another window scores within this of the best
+
+PATCH_FORMAT_PROMPT = """Provide the edit as one or more search/replace blocks in exactly this format:
+<<<<<<< SEARCH
+lines copied exactly from the current script
+=======
+the lines that should replace them
+>>>>>>> REPLACE
+The SEARCH part must match the current script exactly, including indentation, and contain enough lines to be unique. To insert new code, include a neighbouring line in both SEARCH and REPLACE. To add code to an empty script, leave SEARCH empty. Do not output the full script."""
+
+
+class PatchError(Exception):
+    pass
+
+
+def parse_search_replace(text):
+    """ Return the list of (search, replace) hunks in text, in order. """
+    return [(search, replace) for search, replace in SEARCH_REPLACE_PATTERN.findall(text)]
+
+
+def _find_anchor(lines, search_lines):
+    """ Return (start, end) of the lines that search_lines refers to: an exact match, else a match ignoring
+    leading/trailing whitespace, else, for blocks of at least FUZZY_MATCH_MIN_LINES lines, the most similar window of the
+    same length above FUZZY_MATCH_THRESHOLD, provided no window that does not overlap it scores within FUZZY_MATCH_MARGIN
+    of it. Windows are scored line by line (see _window_ratio), so the fuzzy stage stays fast on long blocks. """
+    n = len(search_lines)
+    for normalize in (lambda l: l.rstrip("\n"), lambda l: l.strip()):
+        target = [normalize(l) for l in search_lines]
+        normalized = [normalize(l) for l in lines]
+        matches = [i for i in range(len(lines) - n + 1) if normalized[i:i+n] == target]
+        if len(matches) == 1:
+            return matches[0], matches[0] + n
+        if len(matches) > 1:
+            raise PatchError(f"The SEARCH block matches {len(matches)} places; include more surrounding lines:\n" + "".join(search_lines))
+    if n < FUZZY_MATCH_MIN_LINES:
+        raise PatchError("The SEARCH block does not match the script; copy the lines exactly or include more surrounding lines:\n" + "".join(search_lines))
+
+    # windows within the margin of the threshold are scored too, since they can make a match just above it ambiguous
+    cutoff = FUZZY_MATCH_THRESHOLD - FUZZY_MATCH_MARGIN
+    target = [l.strip() for l in search_lines]
+    stripped = [l.strip() for l in lines]
+    # one matcher per SEARCH line, so difflib indexes each of them once
+    matchers = [difflib.SequenceMatcher(None, "", line, autojunk=False) for line in target]
+    ratios = []
+    for i in range(len(lines) - n + 1):
+        ratio = _window_ratio(stripped[i:i+n], target, matchers, cutoff)
+        if ratio is not None:
+            ratios.append((ratio, i))
+    ratios.sort(reverse=True)
+    if not ratios or ratios[0][0] < FUZZY_MATCH_THRESHOLD:
+        raise PatchError("The SEARCH block does not match the script:\n" + "".join(search_lines))
+    best = ratios[0][1]
+    # windows overlapping the best one score almost as well by construction; only a separate place makes it ambiguous
+    others = [ratio for ratio, i in ratios[1:] if abs(i - best) >= n]
+    if others and ratios[0][0] - others[0] <= FUZZY_MATCH_MARGIN:
+        raise PatchError("The SEARCH block does not match the script exactly and is similar to several places; copy the lines exactly:\n" + "".join(search_lines))
+    return best, best + n
+
+
+def _window_ratio(window, target, matchers, cutoff):
+    """ Mean similarity of the lines of window to the lines of target at the same positions (matchers holds a
+    SequenceMatcher per target line), or None if it is below cutoff. Identical lines count 1 without difflib; the other
+    lines are bounded by difflib's cheap estimates first, so that only near matches pay for the full ratios. """
+    differing = [k for k, line in enumerate(window) if line != target[k]]
+    identical = len(target) - len(differing)
+    for k in differing:
+        matchers[k].set_seq1(window[k])
+    ratios = []
+    for estimate in (difflib.SequenceMatcher.real_quick_ratio, difflib.SequenceMatcher.quick_ratio, difflib.SequenceMatcher.ratio):
+        ratios = [estimate(matchers[k]) for k in differing]
+        if identical + sum(ratios) < cutoff * len(target):
+            return None
+    return (identical + sum(ratios)) / len(target)
+
+
+def apply_search_replace(content, hunks):
+    """ Apply (search, replace) hunks to content in order and return the new content. Raises PatchError if a hunk cannot be anchored. """
+    lines = content.splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+    for search, replace in hunks:
+        replace_lines = replace.splitlines(keepends=True)
+        if not search.strip():
+            lines.extend(replace_lines)
+            continue
+        start, end = _find_anchor(lines, search.splitlines(keepends=True))
+        lines[start:end] = replace_lines
+    return "".join(lines)
+
+
+def validate_python(content, file_name="<edited script>"):
+    """ Raise PatchError if content is not valid Python. """
+    try:
+        compile(content, file_name, "exec")
+    except SyntaxError as e:
+        raise PatchError(f"The edited script is not valid Python: {e}")
@@ -0,0 +1,124 @@
+""" This file contains the static checks run on generated scripts before they are executed, so that syntax errors and
+missing imports reach the Debugger without paying for a full run of the experiment. """
+
+import os
+import sys
+import ast
+import shutil
+import traceback
+import importlib.util
+
+IMPORT_ERRORS = {"ImportError", "ModuleNotFoundError", "Exception", "BaseException"}
+
+
+class _ImportCollector(ast.NodeVisitor):
+    """ Collects (module, node, in_function) for the absolute imports of a module, skipping those guarded by an except
+    clause that would catch an ImportError, since scripts use that pattern for optional dependencies, and those under
+    `if TYPE_CHECKING:`, which never run. in_function tells imports inside a function, which only run if it is called. """
+
+    def __init__(self):
+        self.imports = []
+        self.guarded = 0
+        self.functions = 0
+
+    def visit_Try(self, node):
+        guarded = any(self._catches_import_error(handler.type) for handler in node.handlers)
+        self.guarded += guarded
+        for child in node.body:
+            self.visit(child)
+        self.guarded -= guarded
+        for child in node.handlers + node.orelse + node.finalbody:
+            self.visit(child)
+
+    visit_TryStar = visit_Try
+
+    def visit_If(self, node):
+        test = node.test
+        if (isinstance(test, ast.Name) and test.id == "TYPE_CHECKING") or (isinstance(test, ast.Attribute) and test.attr == "TYPE_CHECKING"):
+            for child in node.orelse:
+                self.visit(child)
+            return
+        self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        self.functions += 1
+        self.generic_visit(node)
+        self.functions -= 1
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    @staticmethod
+    def _catches_import_error(type_node):
+        if type_node is None:
+            return True
+        names = type_node.elts if isinstance(type_node, ast.Tuple) else [type_node]
+        return any(isinstance(n, ast.Name) and n.id in IMPORT_ERRORS for n in names)
+
+    def visit_Import(self, node):
+        if not self.guarded:
+            self.imports.extend((alias.name, node, self.functions > 0) for alias in node.names)
+
+    def visit_ImportFrom(self, node):
+        if not self.guarded and node.level == 0 and node.module:
+            self.imports.append((node.module, node, self.functions > 0))
+
+
+def _format_error(exc_type, message, file_name, code, lineno):
+    line = code.splitlines()[lineno - 1].strip() if 0 < lineno <= len(code.splitlines()) else ""
+    return f'  File "{file_name}", line {lineno}\n    {line}\n{exc_type}: {message}\n'
+
+
+def uses_current_interpreter(python):
+    """ Whether python names the interpreter running this process, whose installed packages can then be inspected. """
+    path = shutil.which(python) or python
+    return os.path.realpath(path) == os.path.realpath(sys.executable)
+
+
+def _resolvable(module, search_dirs, local_files):
+    top = module.split(".")[0]
+    if top in sys.builtin_module_names or top in sys.stdlib_module_names:
+        return True
+    for directory in search_dirs:
+        path = os.path.normpath(os.path.join(directory, top))
+        if path + ".py" in local_files or os.path.exists(path + ".py") or os.path.isdir(path):
+            return True
+        if any(f.startswith(path + os.sep) for f in local_files):
+            return True
+    try:
+        return importlib.util.find_spec(top) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def check_files(files, work_dir, main_file, check_imports=True):
+    """ Compile each of files ({path relative to work_dir: code}) and, if check_imports, make sure that every import
+    run when the file is imported resolves to an installed module or to a file next to main_file or the importing file.
+    Unresolved imports inside functions are only printed as warnings, since the function may never be called.
+
+    Returns a log of the problems found in the format of the interpreter's own errors, or "" if there are none. """
+    errors = []
+    main_dir = os.path.dirname(os.path.join(work_dir, main_file))
+    local_files = {os.path.normpath(os.path.join(work_dir, f)) for f in files}
+    for file_name, code in files.items():
+        if not file_name.endswith(".py"):
+            continue
+        try:
+            tree = compile(code, file_name, "exec", ast.PyCF_ONLY_AST)
+            compile(tree, file_name, "exec")
+        except SyntaxError as e:
+            errors.append("".join(traceback.format_exception_only(type(e), e)))
+            continue
+        if not check_imports:
+            continue
+        collector = _ImportCollector()
+        collector.visit(tree)
+        search_dirs = [main_dir, os.path.dirname(os.path.join(work_dir, file_name))]
+        for module, node, in_function in collector.imports:
+            if _resolvable(module, search_dirs, local_files):
+                continue
+            error = _format_error("ModuleNotFoundError", f"No module named '{module.split('.')[0]}'", file_name, code, node.lineno)
+            if in_function:
+                print(f"Warning: an import inside a function may fail when it is called:\n{error}")
+            else:
+                errors.append(error)
+    return "\n".join(errors)
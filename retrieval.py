@@ -1,22 +1,241 @@
 import os
 import re
+import json
+import hashlib
+import threading
+import time
+import queue
+from collections import OrderedDict
+from concurrent.futures import Future
 import torch
+import tiktoken
 import numpy as np
 from numpy.linalg import norm
 from transformers import AutoTokenizer, AutoModel
 from MLAgentBench.LLM import complete_text
+from MLAgentBench.vector_index import ExactIndex, build_index
+from MLAgentBench.lexical import BM25, fuse_scores
+from MLAgentBench.llm_cache import evict_lru_files
 
 RANKING_MODEL = "models/gemini-2.0-flash"
+RERANK_MODE = "llm" # "llm": RANKING_MODEL ranks the retrieved cases; "local": BM25 + embedding score fusion on CPU; "hybrid": local pre-filter, then LLM
+LOCAL_RERANK_LEXICAL_WEIGHT = 0.5
+HYBRID_RERANK_POOL = 2 # hybrid mode retrieves topk * HYBRID_RERANK_POOL cases and the local reranker keeps topk of them for the LLM
+RERANK_CASE_MAX_TOKENS = 2000 # each case shown to the LLM reranker is truncated to this many tokens
+RERANK_SKIP_MARGIN = 0.1 # skip the LLM rerank if the top case leads every other case by this much similarity; None disables
+EMBEDDING_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "mlagentbench", "embeddings")
+EMBEDDING_STORE_GRACE = 600 # seconds a superseded embedding matrix is kept, for concurrent builds of the same store
+QUERY_CACHE_SIZE = 1024
+QUERY_CACHE_SPILL = False # also keep query embeddings on disk under the embedding store, so that resumed runs reuse them
+QUERY_CACHE_SPILL_MAX_BYTES = 64 * 1024 * 1024 # least recently used spilled query embeddings are evicted beyond this size
+RETRIEVAL_BATCH_WINDOW = 0.01 # seconds to wait for concurrent retrieval requests to coalesce
+RETRIEVAL_MAX_BATCH = 64
+PASSAGE_OVERLAP = 64 # tokens shared by consecutive passages of a long case
+PASSAGE_OVERSAMPLE = 4 # passages retrieved per requested case before pooling them into case scores
+RETRIEVAL_MODE = "dense" # "dense": embedding similarity only; "hybrid": fuse embedding similarity with BM25 over the whole case bank
+HYBRID_LEXICAL_WEIGHT = 0.3
+
+
+def read_case_file(path):
+    try:
+        with open(path, encoding='utf-8') as file:
+            return file.read()
+    except UnicodeDecodeError:
+        # Fallback to latin-1 if UTF-8 fails
+        with open(path, encoding='latin-1') as file:
+            return file.read()
+
+
+class EmbeddingStore:
+    """ On-disk embedding store for a case bank.
+
+    The store keeps a float32 matrix (``embeddings_<sha>.npy``, loaded memory-mapped) with one row per passage and a
+    manifest with the name of that matrix file and the path, mtime, size, content hash and passage count of every case
+    file, so that only new or changed files need to be embedded. Stores are kept apart by case directories, embedding
+    model and passage settings, so databases that differ in any of them never overwrite each other's store.
+    """
+
+    def __init__(self, dirList, model_name, cache_dir=EMBEDDING_CACHE_DIR, params=None):
+        self.model_name = model_name
+        self.params = params or {}
+        key = json.dumps({"dirs": sorted(os.path.abspath(d) for d in dirList), "model": model_name, "params": self.params}, sort_keys=True)
+        self.root = os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16])
+        self.manifest_path = os.path.join(self.root, "manifest.json")
+        self.lexical_path = os.path.join(self.root, "bm25.json")
+
+    def _tmp_path(self, path):
+        # unique per process and thread, so that concurrent builds of the same store never share a temporary file
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def load(self):
+        """ Return (entries, matrix) of the stored index, or ([], None) if it is missing or stale. """
+        # a concurrent save may remove the matrix named by the manifest just read; the new manifest names its successor
+        for _ in range(2):
+            if not os.path.exists(self.manifest_path):
+                return [], None
+            try:
+                with open(self.manifest_path, "r") as f:
+                    manifest = json.load(f)
+                if manifest.get("model") != self.model_name:
+                    print(f"Embedding store was built with {manifest.get('model')}, rebuilding for {self.model_name}")
+                    return [], None
+                if manifest.get("params", {}) != self.params:
+                    print(f"Embedding store was built with {manifest.get('params')}, rebuilding for {self.params}")
+                    return [], None
+                matrix = np.load(os.path.join(self.root, manifest["matrix"]), mmap_mode="r")
+                entries = manifest["entries"]
+                if matrix.shape[0] != sum(e["rows"] for e in entries):
+                    return [], None
+                return entries, matrix
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Warning: could not load embedding store {self.root}: {e}")
+                return [], None
+        return [], None
+
+    def save(self, entries, matrix):
+        """ Atomically replace the stored index. The matrix is written to a file named after its contents, then the
+        manifest naming it replaces the old one, so readers see either the old or the new pair, never a mix. """
+        os.makedirs(self.root, exist_ok=True)
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        matrix_name = f"embeddings_{hashlib.sha256(matrix.data).hexdigest()[:16]}.npy"
+        tmp_matrix = self._tmp_path(os.path.join(self.root, matrix_name))
+        with open(tmp_matrix, "wb") as f:
+            np.save(f, matrix)
+        os.replace(tmp_matrix, os.path.join(self.root, matrix_name))
+        tmp_manifest = self._tmp_path(self.manifest_path)
+        with open(tmp_manifest, "w") as f:
+            json.dump({"model": self.model_name, "params": self.params, "matrix": matrix_name, "entries": entries}, f)
+        os.replace(tmp_manifest, self.manifest_path)
+        # drop superseded matrices, but not recent ones, which a concurrent save may be about to publish
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith("embeddings") and name.endswith(".npy") and name != matrix_name:
+                try:
+                    if time.time() - os.path.getmtime(path) > EMBEDDING_STORE_GRACE:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    def load_lexical(self, hashes):
+        """ Return the stored BM25 index if it was built over cases with exactly these content hashes, else None. """
+        if not os.path.exists(self.lexical_path):
+            return None
+        try:
+            with open(self.lexical_path, "r") as f:
+                data = json.load(f)
+            if data["hashes"] != hashes:
+                return None
+            return BM25.from_dict(data["bm25"])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Warning: could not load lexical index {self.lexical_path}: {e}")
+            return None
+
+    def save_lexical(self, hashes, bm25):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self._tmp_path(self.lexical_path)
+        with open(tmp_path, "w") as f:
+            json.dump({"hashes": hashes, "bm25": bm25.to_dict()}, f)
+        os.replace(tmp_path, self.lexical_path)
+
+
+class QueryEmbeddingCache:
+    """ LRU cache from query text hash to normalized query embedding.
+
+    If spill_dir is set, every embedding is also written there, so that a resumed run (a new process)
+    still skips the forward pass for queries it has already embedded. The spill directory is kept below
+    max_spill_bytes by evicting the least recently used files (by mtime, refreshed on every hit).
+    """
+
+    def __init__(self, maxsize=QUERY_CACHE_SIZE, spill_dir=None, max_spill_bytes=QUERY_CACHE_SPILL_MAX_BYTES, evict_every=100):
+        self.maxsize = maxsize
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.evict_every = evict_every
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model_name, text):
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8", errors="surrogatepass")).hexdigest()
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, key[:2], key + ".npy")
+
+    def get(self, key):
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embedding
+        if self.spill_dir and os.path.exists(self._spill_path(key)):
+            try:
+                embedding = np.load(self._spill_path(key))
+                os.utime(self._spill_path(key))
+            except (OSError, ValueError):
+                embedding = None
+            if embedding is not None:
+                with self._lock:
+                    self.hits += 1
+                self._insert(key, embedding)
+                return embedding
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, embedding):
+        self._insert(key, embedding)
+        if self.spill_dir:
+            path = self._spill_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+            np.save(tmp_path, embedding)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._puts += 1
+                evict = self._puts % self.evict_every == 0
+            if evict:
+                self.evict()
+
+    def evict(self):
+        """ Remove the least recently used spilled embeddings until the spill directory fits in max_spill_bytes. """
+        evict_lru_files(self.spill_dir, self.max_spill_bytes)
+
+    def _insert(self, key, embedding):
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
 
 class RetrievalDatabase:
-    def __init__(self, dirList, model="BAAI/llm-embedder", batch_size=32) -> None:
+    def __init__(self, dirList, model="BAAI/llm-embedder", batch_size=32, cache_dir=EMBEDDING_CACHE_DIR, index="exact", index_params=None, query_cache=None, passage_tokens=None, passage_overlap=PASSAGE_OVERLAP, pooling="max", mode=None) -> None:
         self.dirList = dirList
+        self.batch_size = batch_size
+        self.index_backend = index
+        self.index_params = index_params or {}
         self.device = torch.device("cuda:1" if torch.cuda.is_available() else "cpu")
         self.model_name = model
-        
+
         self.tokenizer = AutoTokenizer.from_pretrained(model)
         self.model = AutoModel.from_pretrained(model, trust_remote_code=True).to(self.device)
-        
+
         # Define query
         if model == "BAAI/llm-embedder":
             self.query_prompt = "Represent this query for retrieving relevant documents: "
@@ -24,31 +243,190 @@ class RetrievalDatabase:
         else:
             self.query_prompt = ""
             self.doc_prompt = ""
-        
-        # Read cases
-        self.case_bank = []
+
+        # Long cases are split into overlapping passages of at most passage_tokens tokens instead of being truncated.
+        if pooling not in ("max", "mean"):
+            raise ValueError(f"pooling must be 'max' or 'mean', not {pooling}")
+        self.passage_tokens = passage_tokens or min(self.tokenizer.model_max_length, 512)
+        self.passage_overlap = passage_overlap
+        self.pooling = pooling
+        self.mode = mode or RETRIEVAL_MODE
+        if self.mode not in ("dense", "hybrid"):
+            raise ValueError(f"mode must be 'dense' or 'hybrid', not {self.mode}")
+
+        self.store = EmbeddingStore(dirList, model, cache_dir=cache_dir, params={"passage_tokens": self.passage_tokens, "passage_overlap": self.passage_overlap}) if cache_dir else None
+        self.last_build_stats = None
+        self.last_rerank_stats = None
+        if query_cache is None:
+            query_cache = QueryEmbeddingCache(spill_dir=os.path.join(self.store.root, "queries") if self.store and QUERY_CACHE_SPILL else None)
+        self.query_cache = query_cache
+        self._batcher = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.case_bank, self.embedding_bank, self.case_offsets, hashes = self._load_cases()
+        self.index = self._build_index(self.embedding_bank)
+        self.lexical = self._build_lexical(self.case_bank, hashes)
+
+    def refresh(self):
+        """ Re-scan the case directories, e.g. after cases were added or edited. Only changed files are re-embedded. """
+        with self._refresh_lock:
+            case_bank, embedding_bank, case_offsets, hashes = self._load_cases()
+            index = self._build_index(embedding_bank)
+            lexical = self._build_lexical(case_bank, hashes)
+            with self._lock:
+                self.case_bank, self.embedding_bank, self.case_offsets, self.index, self.lexical = case_bank, embedding_bank, case_offsets, index, lexical
+
+    def _build_index(self, embedding_bank):
+        if embedding_bank is None or embedding_bank.size == 0:
+            return None
+        return build_index(embedding_bank, backend=self.index_backend, **self.index_params)
+
+    def _build_lexical(self, case_bank, hashes):
+        """ BM25 index over the whole case bank for hybrid mode, reused from the store if the cases did not change. """
+        if self.mode != "hybrid":
+            return None
+        bm25 = self.store.load_lexical(hashes) if self.store else None
+        if bm25 is None:
+            bm25 = BM25(case_bank)
+            if self.store:
+                self.store.save_lexical(hashes, bm25)
+        return bm25
+
+    def _load_cases(self):
+        """ Read the case bank and bring its passage embeddings up to date, embedding only new or changed files.
+        Returns (case_bank, embedding_bank, case_offsets, hashes); the passages of case i are rows case_offsets[i]:case_offsets[i+1]
+        and hashes are the content hashes of the cases. """
+        stored_entries, stored_matrix = self.store.load() if self.store else ([], None)
+        stored = {}
+        offset = 0
+        for e in stored_entries:
+            stored[e["path"]] = (e, offset)
+            offset += e["rows"]
+
+        case_bank = []
+        entries = []
+        spans = []  # (start row in stored_matrix, number of rows), or None if the case has to be embedded
         for dirname in self.dirList:
             if not os.path.exists(dirname):
                 continue
-            fileList = os.listdir(dirname)
-            for filename in fileList:
-                try:
-                    with open(f"{dirname}/{filename}", encoding='utf-8') as file:
-                        self.case_bank.append(self.query_prompt + file.read())
-                except UnicodeDecodeError:
-                    # Fallback to latin-1 if UTF-8 fails
-                    with open(f"{dirname}/{filename}", encoding='latin-1') as file:
-                        self.case_bank.append(self.query_prompt + file.read())
-        
+            for filename in sorted(os.listdir(dirname)):
+                path = os.path.abspath(os.path.join(dirname, filename))
+                if not os.path.isfile(path):
+                    continue
+                st = os.stat(path)
+                text = read_case_file(path)
+                entry = {"path": path, "mtime": st.st_mtime, "size": st.st_size}
+                span = None
+                if path in stored:
+                    old, start = stored[path]
+                    if old["mtime"] == st.st_mtime and old["size"] == st.st_size:
+                        entry["sha1"] = old["sha1"]
+                        span = (start, old["rows"])
+                if "sha1" not in entry:
+                    entry["sha1"] = hashlib.sha1(text.encode("utf-8", errors="surrogatepass")).hexdigest()
+                    if path in stored and stored[path][0]["sha1"] == entry["sha1"]:
+                        span = (stored[path][1], stored[path][0]["rows"])
+                case_bank.append(text)
+                entries.append(entry)
+                spans.append(span)
+
+        hashes = [entry["sha1"] for entry in entries]
+
         # Construct Embedding Database
-        if model == "BAAI/llm-embedder" and len(self.case_bank) > 0:
+        if self.model_name != "BAAI/llm-embedder" or len(case_bank) == 0:
+            return case_bank, None, None, hashes
+
+        missing = [i for i, span in enumerate(spans) if span is None]
+        if not missing and stored_matrix is not None:
+            case_offsets = np.cumsum([0] + [rows for _, rows in spans])
+            if [start for start, _ in spans] == case_offsets[:-1].tolist() and case_offsets[-1] == stored_matrix.shape[0]:
+                # Nothing changed: use the memory-mapped matrix as is.
+                for entry, (_, rows) in zip(entries, spans):
+                    entry["rows"] = rows
+                return case_bank, stored_matrix, case_offsets, hashes
+
+        print(f"Embedding {len(missing)} new or changed cases out of {len(case_bank)}")
+        new_embeddings, new_rows = self._embed_documents([case_bank[i] for i in missing])
+        new_offsets = np.cumsum([0] + new_rows)
+        for j, i in enumerate(missing):
+            spans[i] = (None, new_rows[j])
+        case_offsets = np.cumsum([0] + [rows for _, rows in spans])
+        matrix = np.empty((case_offsets[-1], self.model.config.hidden_size), dtype=np.float32)
+        new_index = {i: j for j, i in enumerate(missing)}
+        for i, (start, rows) in enumerate(spans):
+            if start is None:
+                j = new_index[i]
+                matrix[case_offsets[i]:case_offsets[i + 1]] = new_embeddings[new_offsets[j]:new_offsets[j + 1]]
+            else:
+                matrix[case_offsets[i]:case_offsets[i + 1]] = stored_matrix[start:start + rows]
+            entries[i]["rows"] = rows
+
+        if self.store:
+            self.store.save(entries, matrix)
+        return case_bank, matrix, case_offsets, hashes
+
+    def _split_passages(self, text):
+        """ Tokenize a case into overlapping windows of at most self.passage_tokens tokens (prompt and special tokens included). """
+        prompt_ids = self.tokenizer(self.query_prompt, add_special_tokens=False)["input_ids"]
+        body_ids = self.tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"]
+        window = max(1, self.passage_tokens - len(prompt_ids) - self.tokenizer.num_special_tokens_to_add())
+        stride = max(1, window - self.passage_overlap)
+        passages = []
+        for start in range(0, max(len(body_ids), 1), stride):
+            passages.append(self.tokenizer.build_inputs_with_special_tokens(prompt_ids + body_ids[start:start + window]))
+            if start + window >= len(body_ids):
+                break
+        return passages
+
+    def _embed_documents(self, texts):
+        """ Split texts into passages and embed them in batches of self.batch_size into a preallocated (num_passages, hidden_size) matrix.
+        Passages are sorted by token length so each batch is only padded to the length of its own longest passage.
+        Returns (matrix, number of passages of each text); the passages of a text are consecutive rows. """
+        start = time.time()
+        input_ids = []
+        rows = []
+        for text in texts:
+            passages = self._split_passages(text)
+            input_ids.extend(passages)
+            rows.append(len(passages))
+        # Longest first, so that running out of memory happens on the first batch rather than the last.
+        order = sorted(range(len(input_ids)), key=lambda i: len(input_ids[i]), reverse=True)
+
+        matrix = np.empty((len(input_ids), self.model.config.hidden_size), dtype=np.float32)
+        for batch_start in range(0, len(order), self.batch_size):
+            batch = order[batch_start:batch_start + self.batch_size]
+            x_inputs = self.tokenizer.pad({"input_ids": [input_ids[i] for i in batch]}, return_tensors='pt')
+
+            with torch.no_grad():
+                x_outputs = self.model(input_ids=x_inputs.input_ids.to(self.device), attention_mask=x_inputs.attention_mask.to(self.device))
+                x_outputs = x_outputs.last_hidden_state[:, 0]
+                x_embedding = torch.nn.functional.normalize(x_outputs, p=2, dim=1)
+
+            matrix[batch] = x_embedding.cpu().numpy()
+
+        elapsed = time.time() - start
+        self.last_build_stats = {
+            "cases": len(texts),
+            "passages": len(input_ids),
+            "seconds": elapsed,
+            "cases_per_sec": len(texts) / elapsed if elapsed > 0 else float("inf"),
+        }
+        print(f"Embedded {len(texts)} cases ({len(input_ids)} passages) in {elapsed:.1f}s ({self.last_build_stats['cases_per_sec']:.1f} cases/sec, batch size {self.batch_size})")
+        return matrix, rows
+
+    def _embed_queries(self, queries):
+        """ Return the normalized (len(queries), hidden_size) embeddings of queries. Cached queries are looked up,
+        the rest are embedded in one padded forward pass. """
+        keys = [self.query_cache.key(self.model_name, self.query_prompt + query) for query in queries]
+        embeddings = [self.query_cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
             x_inputs = self.tokenizer(
-                self.case_bank,
-                padding=True, 
+                [self.query_prompt + queries[i] for i in missing],
+                padding=True,
                 truncation= True,
                 return_tensors='pt'
             )
-            
             input_ids = x_inputs.input_ids.to(self.device)
             attention_mask = x_inputs.attention_mask.to(self.device)
 
@@ -56,45 +434,149 @@ class RetrievalDatabase:
                 x_outputs = self.model(input_ids=input_ids, attention_mask=attention_mask)
                 x_outputs = x_outputs.last_hidden_state[:, 0]
                 x_embedding = torch.nn.functional.normalize(x_outputs, p=2, dim=1)
-            
-            self.embedding_bank = x_embedding
-        else:
-            self.embedding_bank = None
-            
+
+            x_embedding = x_embedding.cpu().numpy().astype(np.float32)
+            for j, i in enumerate(missing):
+                embeddings[i] = x_embedding[j:j + 1]
+                self.query_cache.put(keys[i], embeddings[i])
+        return np.concatenate(embeddings, axis=0)
+
+    def retrieve_many(self, queries, num=10):
+        """ Retrieve the top num cases for each query with one forward pass and one index search.
+        Each case is scored by max- or mean-pooling the similarities of all its passages; see _dense_candidates for
+        how the candidate cases are found. In hybrid mode the top BM25 cases are added to the candidates and
+        candidates are ranked by fused dense and BM25 scores. Returns a list of (cases, similarities) in the order of queries. """
+        with self._lock:
+            case_bank, embedding_bank, case_offsets, index, lexical = self.case_bank, self.embedding_bank, self.case_offsets, self.index, self.lexical
+        if index is None or not queries:
+            return [([], []) for _ in queries]
+
+        x_embedding = self._embed_queries(list(queries))
+        dense_candidates, case_scores = self._dense_candidates(index, embedding_bank, case_offsets, x_embedding, num)
+        pool = np.max if self.pooling == "max" else np.mean
+        results = []
+        for i, (query, query_embedding) in enumerate(zip(queries, x_embedding)):
+            candidates = dense_candidates[i]
+            if lexical is not None:
+                lexical_scores = lexical.scores(query)
+                lexical_top = np.argsort(-lexical_scores, kind="stable")[:num]
+                candidates = np.concatenate([candidates, lexical_top[lexical_scores[lexical_top] > 0]])
+            candidates = np.unique(candidates)
+            if case_scores is not None:
+                scores = case_scores[i, candidates].astype(np.float32)
+            else:
+                scores = np.array([
+                    pool(embedding_bank[case_offsets[c]:case_offsets[c + 1]] @ query_embedding) for c in candidates
+                ], dtype=np.float32)
+            ranking_scores = scores
+            if lexical is not None:
+                ranking_scores = fuse_scores(scores, lexical_scores[candidates], lexical_weight=HYBRID_LEXICAL_WEIGHT)
+            order = np.argsort(-ranking_scores, kind="stable")[:num]
+            results.append(([case_bank[i] for i in candidates[order].tolist()], scores[order]))
+        return results
+
+    def _dense_candidates(self, index, embedding_bank, case_offsets, x_embedding, num):
+        """ Return (candidates, case_scores): for each query, an array of at least num distinct case ids (or every case
+        if the bank is smaller), and, for the exact backend, the pooled score of every case for every query (else None).
+
+        The exact backend scores all passages and pools them per case with reduceat. Other backends search passages,
+        and the search is widened (more results, more probed lists) until the hits cover num distinct cases, since a
+        single long case can otherwise fill every passage slot. """
+        num_rows = embedding_bank.shape[0]
+        num_cases = len(case_offsets) - 1
+        if isinstance(index, ExactIndex):
+            row_scores = np.asarray(x_embedding @ np.asarray(embedding_bank).T)
+            counts = np.diff(case_offsets)
+            starts = np.minimum(case_offsets[:-1], num_rows - 1)
+            if self.pooling == "max":
+                case_scores = np.maximum.reduceat(row_scores, starts, axis=1)
+            else:
+                case_scores = np.add.reduceat(row_scores, starts, axis=1) / np.maximum(counts, 1)
+            case_scores[:, counts == 0] = -np.inf
+            return [np.argsort(-scores, kind="stable")[:num] for scores in case_scores], case_scores
+
+        k = min(num * PASSAGE_OVERSAMPLE, num_rows)
+        _, indices = index.search(x_embedding, k)
+        candidates = []
+        for query_embedding, row_indices in zip(x_embedding, indices):
+            search_k, nprobe = k, getattr(index, "nprobe", None)
+            while True:
+                cases = np.unique(np.searchsorted(case_offsets, row_indices[row_indices >= 0], side="right") - 1)
+                if len(cases) >= min(num, num_cases) or (search_k >= num_rows and (nprobe is None or nprobe >= index.nlist)):
+                    break
+                search_k = min(search_k * 2, num_rows)
+                if nprobe is None:
+                    _, row_indices = index.search(query_embedding[None, :], search_k)
+                else:
+                    nprobe = min(nprobe * 2, index.nlist)
+                    _, row_indices = index.search(query_embedding[None, :], search_k, nprobe=nprobe)
+                row_indices = row_indices[0]
+            candidates.append(cases)
+        return candidates, None
+
     def retrieve_case(self, query, num=10):
-        if self.embedding_bank is None or self.embedding_bank.numel() == 0:
-            return [], []
-            
-        x_inputs = self.tokenizer(
-            self.query_prompt + query,
-            padding=True, 
-            truncation= True,
-            return_tensors='pt'
-        )
-        input_ids = x_inputs.input_ids.to(self.device)
-        attention_mask = x_inputs.attention_mask.to(self.device)
-
-        with torch.no_grad():
-            x_outputs = self.model(input_ids=input_ids, attention_mask=attention_mask)
-            x_outputs = x_outputs.last_hidden_state[:, 0]
-            x_embedding = torch.nn.functional.normalize(x_outputs, p=2, dim=1)
-        
-        similarity = (x_embedding @ self.embedding_bank.T).squeeze()         
-        _, ranking_index = torch.topk(similarity, num)
-
-        ranking_index = ranking_index.cpu().numpy().tolist()
-        if self.query_prompt:
-            return [self.case_bank[i].split(self.query_prompt)[1] for i in ranking_index], similarity[ranking_index]
-        else:
-            return [self.case_bank[i] for i in ranking_index], similarity[ranking_index]
-    
-    def retrieve_then_rerank(self, query, research_problem, research_log, log_file, topk=5):
+        return self.retrieve_many([query], num=num)[0]
+
+    def submit(self, query, num=10):
+        """ Queue a retrieval and return a Future of (cases, similarities). Requests submitted by concurrent
+        callers within RETRIEVAL_BATCH_WINDOW are answered by a single retrieve_many call. """
+        with self._lock:
+            if self._batcher is None:
+                self._batcher = RetrievalBatcher(self)
+        return self._batcher.submit(query, num)
+
+    @staticmethod
+    def local_rerank(query, cases, similarity):
+        """ Order cases by a fusion of their dense similarity and the BM25 score of query against them. """
+        lexical = BM25(cases).scores(query)
+        fused = fuse_scores(similarity, lexical, lexical_weight=LOCAL_RERANK_LEXICAL_WEIGHT)
+        return np.argsort(-fused, kind="stable").tolist()
+
+    def retrieve_then_rerank(self, query, research_problem, research_log, log_file, topk=5, rerank=None):
+        rerank = rerank or RERANK_MODE
+        if rerank not in ("llm", "local", "hybrid"):
+            raise ValueError(f"rerank must be 'llm', 'local' or 'hybrid', not {rerank}")
+        stats = {"mode": rerank}
+        self.last_rerank_stats = stats
+
         # Retriever
-        case_bank, _ = self.retrieve_case(query, num=topk)
+        start = time.time()
+        case_bank, similarity = self.submit(query, num=topk * HYBRID_RERANK_POOL if rerank == "hybrid" else topk).result()
+        stats["retrieve_seconds"] = time.time() - start
         if not case_bank:
             return "No relevant cases found. Please proceed with basic implementation."
-            
+
+        if rerank in ("local", "hybrid"):
+            start = time.time()
+            ranking = self.local_rerank(query, case_bank, similarity)[:topk]
+            case_bank = [case_bank[i] for i in ranking]
+            similarity = np.asarray(similarity)[ranking]
+            stats["local_seconds"] = time.time() - start
+            if rerank == "local":
+                print(f"Rerank stats: {stats}")
+                return case_bank[0]
+
+        # Fast path: nothing to rank, or a clear winner by similarity.
+        if len(case_bank) == 1:
+            stats["skipped_llm"] = "single candidate"
+            print(f"Rerank stats: {stats}")
+            return case_bank[0]
+        if RERANK_SKIP_MARGIN is not None and similarity[0] - np.max(similarity[1:]) >= RERANK_SKIP_MARGIN:
+            stats["skipped_llm"] = f"similarity margin {similarity[0] - np.max(similarity[1:]):.3f}"
+            print(f"Rerank stats: {stats}")
+            return case_bank[0]
+
         # RankReviser
+        enc = tiktoken.get_encoding("cl100k_base")
+        cases_prompt = ""
+        for i, case in enumerate(case_bank):
+            tokens = enc.encode(case)
+            if len(tokens) > RERANK_CASE_MAX_TOKENS:
+                case = enc.decode(tokens[:RERANK_CASE_MAX_TOKENS]) + "\n[...]"
+            cases_prompt += f"""[{i+1}] ```
+{case}
+```
+"""
         prompt = f"""
 You are a helpful intelligent system that can identify the informativeness of some cases given a research problem and research log.
 Research Problem: ```
@@ -104,26 +586,92 @@ Research Log: ```
 {research_log}
 ```
 Here are some solution cases relevant to this research problem, each indicated by number identifier [].
-[1] ```
-{case_bank[0]}
-```
-[2] ```
-{case_bank[1]}
-```
-[3] ```
-{case_bank[2]}
-```
-[4] ```
-{case_bank[3]}
-```
-[5]```
-{case_bank[4]}
-```
-Rank 5 cases above based on their relevance, informativess and helpfulness to the research problem and the research log for planning the next experiment step. The cases should be listed in descending order using identifiers. The most relevant, informative and helpful case should be listed first. The output format should be [] > [], e.g., [1] > [2]. Only response the ranking results, do not say any word or explain.
+{cases_prompt}Rank {len(case_bank)} cases above based on their relevance, informativess and helpfulness to the research problem and the research log for planning the next experiment step. The cases should be listed in descending order using identifiers. The most relevant, informative and helpful case should be listed first. The output format should be [] > [], e.g., [1] > [2]. Only response the ranking results, do not say any word or explain.
 """
+        start = time.time()
         ranking = complete_text(prompt, model=RANKING_MODEL, log_file=log_file)
-        ranking = re.findall(r'\[(\d+)\]', ranking)
+        stats["llm_seconds"] = time.time() - start
+        stats["llm_prompt_tokens"] = len(enc.encode(prompt))
+        print(f"Rerank stats: {stats}")
+        ranking = [int(num)-1 for num in re.findall(r'\[(\d+)\]', ranking)]
+        ranking = [i for i in ranking if 0 <= i < len(case_bank)]
         if not ranking:
             return case_bank[0]  # Return first case if ranking fails
-        ranking = [int(num)-1 for num in ranking]
-        return case_bank[ranking[0]]
\ No newline at end of file
+        return case_bank[ranking[0]]
+
+
+class RetrievalBatcher:
+    """ Micro-batching queue in front of RetrievalDatabase.retrieve_many.
+
+    A daemon thread takes the first pending request, waits up to window seconds for more to arrive
+    (at most max_batch), answers all of them with one retrieve_many call and resolves each request's Future.
+    """
+
+    def __init__(self, database, window=RETRIEVAL_BATCH_WINDOW, max_batch=RETRIEVAL_MAX_BATCH):
+        self.database = database
+        self.window = window
+        self.max_batch = max_batch
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="retrieval-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, query, num=10):
+        future = Future()
+        self._requests.put((query, num, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.time() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                results = self.database.retrieve_many([query for query, _, _ in batch], num=max(num for _, num, _ in batch))
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, num, future), (cases, similarity) in zip(batch, results):
+                future.set_result((cases[:num], similarity[:num]))
+
+
+_DATABASES = {} # key -> Future of the RetrievalDatabase, so that a build does not hold _DATABASES_LOCK
+_DATABASES_LOCK = threading.Lock()
+
+def get_retrieval_database(dirList, model="BAAI/llm-embedder", **kwargs):
+    """ Return the process-wide RetrievalDatabase for (dirList, model, kwargs), building it on first use.
+    The tokenizer, model weights and case embeddings are then shared across steps, agents and requests.
+    Calls with different settings (mode, index, passage_tokens, ...) get different databases. A database is built
+    outside the global lock: concurrent callers for the same key wait for that build, others are not blocked. """
+    settings = json.dumps(kwargs, sort_keys=True, default=repr)
+    key = (tuple(os.path.abspath(d) for d in dirList), model, settings)
+    with _DATABASES_LOCK:
+        future = _DATABASES.get(key)
+        build = future is None
+        if build:
+            future = _DATABASES[key] = Future()
+    if build:
+        try:
+            future.set_result(RetrievalDatabase(list(dirList), model=model, **kwargs))
+        except BaseException as e:
+            # let a later call try again rather than caching the failure
+            with _DATABASES_LOCK:
+                del _DATABASES[key]
+            future.set_exception(e)
+    return future.result()
+
+def refresh_retrieval_databases():
+    """ Re-scan the case directories of every shared RetrievalDatabase. """
+    with _DATABASES_LOCK:
+        futures = list(_DATABASES.values())
+    for future in futures:
+        if future.done() and future.exception() is None:
+            future.result().refresh()
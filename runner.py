@@ -12,6 +12,7 @@ from MLAgentBench.environment import Environment
 from MLAgentBench.agents.agent import Agent, SimpleActionAgent, ReasoningActionAgent
 from MLAgentBench.agents.dsagent import DSAgent
 from MLAgentBench import high_level_actions
+from MLAgentBench import low_level_actions
 from MLAgentBench.high_level_actions import HIGH_LEVEL_ACTIONS
 from MLAgentBench.low_level_actions import read_file, write_file, execute_script
 from MLAgentBench.schema import ActionInfo, EnvException
@@ -55,7 +56,15 @@ def main():
     parser.add_argument('--interactive', action='store_true', help='Run in interactive mode')
     parser.add_argument('--resume', type=str, default=None, help='Path to resume from a previous experiment')
     parser.add_argument('--resume_step', type=int, default=0, help='Step number to resume from')
+    parser.add_argument('--rerank', type=str, default=retrieval.RERANK_MODE, choices=['llm', 'local', 'hybrid'], help='How retrieved cases are reranked: by the LLM, by a local BM25 + embedding reranker, or local pre-filter then LLM')
+    parser.add_argument('--retrieval_mode', type=str, default=retrieval.RETRIEVAL_MODE, choices=['dense', 'hybrid'], help='Retrieve cases by embedding similarity only, or fused with BM25')
+    parser.add_argument('--execute_timeout', type=float, default=low_level_actions.EXECUTE_TIMEOUT, help='Kill a script run by Execute Script after this many seconds (default: no limit)')
+    parser.add_argument('--execute_idle_timeout', type=float, default=low_level_actions.EXECUTE_IDLE_TIMEOUT, help='Kill a script run by Execute Script that prints nothing for this many seconds (default: no limit)')
     args = parser.parse_args()
+    retrieval.RERANK_MODE = args.rerank
+    retrieval.RETRIEVAL_MODE = args.retrieval_mode
+    low_level_actions.EXECUTE_TIMEOUT = args.execute_timeout
+    low_level_actions.EXECUTE_IDLE_TIMEOUT = args.execute_idle_timeout
 
     # Check for Google API key
     if not os.getenv("GOOGLE_API_KEY"):
@@ -71,65 +80,67 @@ def main():
     os.makedirs(args.log_dir, exist_ok=True)
     os.makedirs(args.work_dir, exist_ok=True)
     
-    # Initialize environment
-    env = Environment(args)
+    # Initialize environment; leaving the with block journals and compacts its trace
+    with Environment(args) as env:
     
-    # Initialize research log with proper kwargs structure
-    write_file(
-        file_name=args.log,
-        content=f"Research Problem: {args.problem}\n",
-        work_dir=args.output,
-        trace=env.trace,
-        device=args.device,
-        python=args.python,
-        read_only_files=[args.input] if args.input else []
-    )
+        # Initialize research log with proper kwargs structure
+        write_file(
+            file_name=args.log,
+            content=f"Research Problem: {args.problem}\n",
+            work_dir=args.output,
+            trace=env.recording_trace,  # low level steps are recorded into the environment's own trace
+            device=args.device,
+            python=args.python,
+            read_only_files=[args.input] if args.input else []
+        )
     
-    # Get experiment plan
-    experiment_log = read_file(
-        file_name=args.log,
-        work_dir=args.output,
-        trace=env.trace,
-        device=args.device,
-        python=args.python,
-        read_only_files=[args.input] if args.input else []
-    )
+        # Get experiment plan
+        experiment_log = read_file(
+            file_name=args.log,
+            work_dir=args.output,
+            trace=env.recording_trace,
+            device=args.device,
+            python=args.python,
+            read_only_files=[args.input] if args.input else []
+        )
     
-    plan = HIGH_LEVEL_ACTIONS[1].function(
-        experiment_log,
-        research_problem=args.problem,
-        log_file=args.log,
-        trace=env.trace,
-        device=args.device,
-        python=args.python,
-        read_only_files=[args.input] if args.input else []
-    )
+        plan = HIGH_LEVEL_ACTIONS[1].function(
+            experiment_log,
+            research_problem=args.problem,
+            log_file=args.log,
+            trace=env.recording_trace,
+            device=args.device,
+            python=args.python,
+            read_only_files=[args.input] if args.input else []
+        )
     
-    # Execute plan
-    execution_log, diff = HIGH_LEVEL_ACTIONS[6].function(
-        "experiment.py",
-        plan,
-        "experiment.py",
-        work_dir=args.output,
-        research_problem=args.problem,
-        log_file=args.log,
-        trace=env.trace,
-        device=args.device,
-        python=args.python,
-        read_only_files=[args.input] if args.input else []
-    )
+        # Execute plan
+        execution_log, diff = HIGH_LEVEL_ACTIONS[6].function(
+            "experiment.py",
+            plan,
+            "experiment.py",
+            work_dir=args.output,
+            research_problem=args.problem,
+            log_file=args.log,
+            trace=env.recording_trace,
+            device=args.device,
+            python=args.python,
+            read_only_files=[args.input] if args.input else []
+        )
     
-    # Append execution results to research log
-    HIGH_LEVEL_ACTIONS[3].function(
-        execution_log,
-        work_dir=args.output,
-        trace=env.trace,
-        device=args.device,
-        python=args.python,
-        read_only_files=[args.input] if args.input else []
-    )
+        # Append execution results to research log
+        HIGH_LEVEL_ACTIONS[3].function(
+            execution_log,
+            work_dir=args.output,
+            trace=env.recording_trace,
+            device=args.device,
+            python=args.python,
+            read_only_files=[args.input] if args.input else []
+        )
     
-    print("Experiment completed. Check the research log for details.")
+        env.save("final")
+
+        print("Experiment completed. Check the research log for details.")
 
 
 if __name__ == "__main__":
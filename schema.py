@@ -1,18 +1,34 @@
 import dataclasses
 from dataclasses import dataclass
 from argparse import Namespace
+import os
 import json
-from typing import Any, Dict, List
+import hashlib
+import threading
+from types import MappingProxyType
+from collections.abc import Sequence
+from typing import Any, Dict, List, Optional
 
 class EnhancedJSONEncoder(json.JSONEncoder):
     def default(self, o):
         #if it is a function, use its string name
         if dataclasses.is_dataclass(o):
-            return dataclasses.asdict(o)
+            # one level at a time (the encoder recurses) rather than dataclasses.asdict, which deep-copies every field
+            # fields can opt out of the JSON ("json": False) or be left out while unset ("json": "omit_none")
+            return {
+                f.name: getattr(o, f.name) for f in dataclasses.fields(o)
+                if f.metadata.get("json", True) and not (f.metadata.get("json") == "omit_none" and getattr(o, f.name) is None)
+            }
         elif hasattr(o, '__call__'):
             return o.__name__
         elif isinstance(o, Namespace):
             return vars(o)
+        elif isinstance(o, ReadOnlyList):
+            return list(o)
+        elif isinstance(o, MappingProxyType):
+            return dict(o)
+        elif isinstance(o, SpilledObservation):
+            return str(o)
 
         return super().default(o)
 
@@ -27,7 +43,7 @@ class EnvException(Exception):
     def __str__(self):
         return self.message
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class ActionInfo:
     name: str
     description: str
@@ -36,22 +52,114 @@ class ActionInfo:
     function: str
     is_primitive: bool = False
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Action:
     name: str
     args: Dict[str, Any]
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Step:
     action: Action
-    observation: str  # What was returned
+    observation: str  # What was returned; may be a SpilledObservation for large low level observations
     timestamp: float  # When the action was taken
+    # Resource usage of the process the action ran (see run_streaming), if any; left out of the JSON otherwise
+    usage: Optional[Dict[str, Any]] = dataclasses.field(default=None, metadata={"json": "omit_none"})
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Trace:
     steps: List[Step]
     low_level_steps: List[Step]
     action_infos: Dict[str, ActionInfo]
     task_description: str
+    # interns the observations of the trace's steps; not part of the saved trace
+    observations: Optional["ObservationStore"] = dataclasses.field(default=None, compare=False, repr=False, metadata={"json": False})
+
+
+class ReadOnlyList(Sequence):
+    """ A read-only view of a list, so that the environment can hand out its trace without copying it. """
+    __slots__ = ("_items",)
+
+    def __init__(self, items):
+        self._items = items
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __repr__(self):
+        return f"ReadOnlyList({self._items!r})"
+
+
+def trace_view(trace):
+    """ Return a read-only view of trace in O(1); it reflects later changes to trace. """
+    return Trace(
+        steps=ReadOnlyList(trace.steps),
+        low_level_steps=ReadOnlyList(trace.low_level_steps),
+        action_infos=MappingProxyType(trace.action_infos),
+        task_description=trace.task_description,
+        observations=trace.observations,
+    )
+
+
+OBSERVATION_SPILL_BYTES = None # low level observations of at least this many characters are kept on disk and loaded lazily; None keeps them in memory
+
+class SpilledObservation:
+    """ Handle to an observation kept on disk by ObservationStore; str() loads it. """
+    __slots__ = ("path", "length")
+
+    def __init__(self, path, length):
+        self.path = path
+        self.length = length
+
+    def __str__(self):
+        with open(self.path, "r", encoding="utf-8", errors="surrogatepass") as f:
+            return f.read()
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return f"SpilledObservation({self.path!r}, {self.length})"
+
+
+class ObservationStore:
+    """ Content-addressed table of observations. Equal observations are stored once: the first string seen is returned
+    for every later copy. If spill_dir is set, observations of at least OBSERVATION_SPILL_BYTES characters are written
+    to spill_dir under their sha256 instead and replaced by a SpilledObservation. Each environment has its own store,
+    held by its trace. """
+
+    def __init__(self, spill_dir=None):
+        self.spill_dir = spill_dir
+        self._strings = {}
+        self._spilled = {}
+
+    def intern(self, observation, spill=True):
+        if not isinstance(observation, str):
+            return observation
+        if spill and self.spill_dir is not None and OBSERVATION_SPILL_BYTES is not None and len(observation) >= OBSERVATION_SPILL_BYTES:
+            data = observation.encode("utf-8", errors="surrogatepass")
+            sha = hashlib.sha256(data).hexdigest()
+            handle = self._spilled.get(sha)
+            if handle is None:
+                path = os.path.join(self.spill_dir, sha[:2], sha + ".txt")
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp_path, path)
+                handle = self._spilled[sha] = SpilledObservation(path, len(observation))
+            return handle
+        return self._strings.setdefault(observation, observation)
+
+    def close(self):
+        """ Drop the tables; observations already handed out, and spilled files, stay valid. """
+        self._strings.clear()
+        self._spilled.clear()
@@ -0,0 +1,117 @@
+""" This file contains the content-addressed store used to snapshot the workspace after every step. """
+
+import os
+import json
+import stat
+import shutil
+import hashlib
+
+
+class SnapshotStore:
+    """ Workspace snapshots where each distinct file content is stored once.
+
+    Blobs live read-only under root/blobs/<sha[:2]>/<sha>. A step's snapshot is the manifest root/step_<n>.json, mapping
+    each relative path to its sha, size, mtime and mode. If tree_root is given, the snapshot is also laid out for browsing
+    as hardlinks to the blobs at tree_root/step_<n>_files. A file is only re-hashed if its size or mtime changed since
+    the previous snapshot.
+    """
+
+    def __init__(self, root, tree_root=None):
+        self.root = root
+        self.tree_root = tree_root
+        self._known = {}  # absolute path -> (size, mtime_ns, sha) as of the last snapshot
+
+    def _blob_path(self, sha):
+        return os.path.join(self.root, "blobs", sha[:2], sha)
+
+    def _manifest_path(self, step):
+        return os.path.join(self.root, f"step_{step}.json")
+
+    @staticmethod
+    def _hash(path):
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def _store(self, path, sha):
+        blob = self._blob_path(sha)
+        if os.path.exists(blob):
+            return blob
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp = f"{blob}.{os.getpid()}.tmp"
+        shutil.copyfile(path, tmp)
+        os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(tmp, blob)
+        return blob
+
+    def snapshot(self, work_dir, step, include=None):
+        """ Snapshot the files of work_dir for which include(relative path) is true and return the manifest. """
+        files = {}
+        known = {}
+        for path, _, file_names in os.walk(work_dir):
+            for file_name in file_names:
+                full_path = os.path.join(path, file_name)
+                rel_path = os.path.join(os.path.relpath(path, work_dir), file_name)
+                if include is not None and not include(rel_path):
+                    continue
+                try:
+                    st = os.stat(full_path)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                cached = self._known.get(full_path)
+                if cached is not None and cached[:2] == (st.st_size, st.st_mtime_ns) and os.path.exists(self._blob_path(cached[2])):
+                    sha = cached[2]
+                else:
+                    sha = self._hash(full_path)
+                    self._store(full_path, sha)
+                known[full_path] = (st.st_size, st.st_mtime_ns, sha)
+                files[rel_path] = {"sha": sha, "size": st.st_size, "mtime": st.st_mtime, "mode": stat.S_IMODE(st.st_mode)}
+        self._known = known
+
+        manifest = {"step": step, "files": files}
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self._manifest_path(step) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self._manifest_path(step))
+
+        if self.tree_root is not None:
+            self._link_tree(manifest, os.path.join(self.tree_root, f"step_{step}_files"))
+        return manifest
+
+    def _link_tree(self, manifest, dest):
+        if os.path.exists(dest):
+            shutil.rmtree(dest)
+        os.makedirs(dest)
+        for rel_path, entry in manifest["files"].items():
+            target = os.path.join(dest, rel_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(self._blob_path(entry["sha"]), target)
+            except OSError:
+                # e.g. the tree is on another file system than the store
+                shutil.copyfile(self._blob_path(entry["sha"]), target)
+
+    def has(self, step):
+        return os.path.exists(self._manifest_path(step))
+
+    def load_manifest(self, step):
+        with open(self._manifest_path(step), "r") as f:
+            return json.load(f)
+
+    def materialize(self, step, dest):
+        """ Recreate the workspace of step in dest. Files are copied out of the store, never hardlinked, so that editing
+        the workspace cannot alter the stored snapshots. """
+        manifest = self.load_manifest(step)
+        os.makedirs(dest, exist_ok=True)
+        for rel_path, entry in manifest["files"].items():
+            target = os.path.join(dest, rel_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(self._blob_path(entry["sha"]), target)
+            os.chmod(target, entry["mode"])
+            os.utime(target, (entry["mtime"], entry["mtime"]))
+        return manifest
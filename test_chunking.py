@@ -0,0 +1,40 @@
+from MLAgentBench.chunking import chunk_text, chunk_file
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_chunks_cover_the_text():
+    text = "".join(f"word{i} word word\n" for i in range(10))
+    chunks = chunk_text(text, max_tokens=7, token_counter=count_words)
+    assert "".join(c.text for c in chunks) == text
+    assert [(c.start_line, c.end_line) for c in chunks] == [(1, 2), (3, 4), (5, 6), (7, 8), (9, 10)]
+    for c in chunks:
+        assert text[c.start_char:c.end_char] == c.text
+
+
+def test_overlap_repeats_trailing_lines():
+    text = "a b\nc d\ne f\ng h\n"
+    chunks = chunk_text(text, max_tokens=4, overlap_tokens=2, token_counter=count_words)
+    assert [c.text for c in chunks] == ["a b\nc d\n", "c d\ne f\n", "e f\ng h\n"]
+    assert [c.start_line for c in chunks] == [1, 2, 3]
+
+
+def test_long_line_is_split():
+    line = "x " * 10 + "\n"
+    chunks = chunk_text("a\n" + line + "b\n", max_tokens=4, token_counter=count_words)
+    assert [c.start_line for c in chunks] == [1, 2, 2, 2, 3]
+    assert "".join(c.text for c in chunks) == "a\n" + line + "b\n"
+
+
+def test_empty_text():
+    assert chunk_text("") == []
+
+
+def test_chunk_file(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_text("a,b\r\n1,2\r\n3,4\r\n", newline="")
+    chunks = list(chunk_file(str(path), max_tokens=2, token_counter=lambda line: 1))
+    assert [c.text for c in chunks] == ["a,b\r\n1,2\r\n", "3,4\r\n"]
+    assert chunks[1].start_char == 10
@@ -0,0 +1,43 @@
+import numpy as np
+
+from MLAgentBench.lexical import BM25, tokenize, min_max_normalize, fuse_scores
+
+DOCUMENTS = [
+    "Train a LightGBM model and report roc_auc.",
+    "Fine-tune a BERT model for text classification.",
+    "Forecast sales with ARIMA and report MAPE.",
+]
+
+
+def test_tokenize():
+    assert tokenize("LightGBM, roc_auc & MAPE!") == ["lightgbm", "roc_auc", "mape"]
+
+
+def test_scores_rank_matching_documents():
+    bm25 = BM25(DOCUMENTS)
+    scores = bm25.scores("lightgbm roc_auc")
+    assert scores.shape == (3,)
+    assert scores.argmax() == 0 and scores[1] == 0 and scores[2] == 0
+    assert bm25.scores("mape").argmax() == 2
+    assert not bm25.scores("unknown words").any()
+
+
+def test_rare_terms_weigh_more():
+    bm25 = BM25(DOCUMENTS)
+    assert bm25.idf("lightgbm") > bm25.idf("model")
+
+
+def test_round_trip():
+    bm25 = BM25(DOCUMENTS)
+    restored = BM25.from_dict(bm25.to_dict())
+    assert np.allclose(restored.scores("model report mape"), bm25.scores("model report mape"))
+
+
+def test_empty_index():
+    assert BM25([]).scores("anything").shape == (0,)
+
+
+def test_fuse_scores():
+    assert np.allclose(min_max_normalize([2, 4, 3]), [0, 1, 0.5])
+    assert np.allclose(min_max_normalize([1, 1]), [0, 0])
+    assert np.allclose(fuse_scores([0, 1, 2], [2, 0, 0], lexical_weight=0.5), [0.5, 0.25, 0.5])
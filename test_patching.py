@@ -0,0 +1,87 @@
+import pytest
+
+from MLAgentBench.patching import PatchError, parse_search_replace, apply_search_replace, validate_python
+
+SCRIPT = """import pandas as pd
+
+def load(path):
+    df = pd.read_csv(path)
+    df = df.dropna()
+    return df
+
+def train(df):
+    model = fit(df)
+    return model
+"""
+
+
+def hunk(search, replace):
+    return f"<<<<<<< SEARCH\n{search}=======\n{replace}>>>>>>> REPLACE"
+
+
+def test_parse_search_replace():
+    text = "Some words.\n" + hunk("a\n", "b\n") + "\nmore words\n" + hunk("c\nd\n", "")
+    assert parse_search_replace(text) == [("a\n", "b\n"), ("c\nd\n", "")]
+
+
+def test_exact_match():
+    new = apply_search_replace(SCRIPT, [("    df = df.dropna()\n", "    df = df.fillna(0)\n")])
+    assert new == SCRIPT.replace("dropna()", "fillna(0)")
+
+
+def test_hunks_apply_in_order():
+    hunks = [("    df = df.dropna()\n", "    df = df.fillna(0)\n"), ("    df = df.fillna(0)\n", "    df = df.fillna(1)\n")]
+    assert apply_search_replace(SCRIPT, hunks) == SCRIPT.replace("dropna()", "fillna(1)")
+
+
+def test_empty_search_appends():
+    assert apply_search_replace("x = 1", [("", "y = 2\n")]) == "x = 1\ny = 2\n"
+
+
+def test_whitespace_insensitive_match():
+    new = apply_search_replace(SCRIPT, [("df = df.dropna()  \n", "    df = df.fillna(0)\n")])
+    assert new == SCRIPT.replace("dropna()", "fillna(0)")
+
+
+def test_ambiguous_exact_match():
+    with pytest.raises(PatchError, match="matches 2 places"):
+        apply_search_replace("a = 1\nb = 2\na = 1\nb = 2\n", [("a = 1\nb = 2\n", "")])
+
+
+def test_fuzzy_match():
+    search = "def load(path):\n    df = pd.read_csv(path)\n    df = df.dropna(how='any')\n    return df\n"
+    new = apply_search_replace(SCRIPT, [(search, "def load(path):\n    return pd.read_csv(path)\n")])
+    assert "dropna" not in new and "    return pd.read_csv(path)\n" in new and "def train(df):" in new
+
+
+def test_no_fuzzy_match_for_short_blocks():
+    with pytest.raises(PatchError, match="does not match"):
+        apply_search_replace(SCRIPT, [("    df = df.dropna(how='any')\n", "")])
+
+
+def test_ambiguous_fuzzy_match():
+    content = "".join(f"x_{i} = compute(a, b, c)\ny_{i} = compute(d, e, f)\nz_{i} = compute(g, h, i)\n" for i in range(2))
+    search = "x_ = compute(a, b, c)\ny_ = compute(d, e, f)\nz_ = compute(g, h, i)\n"
+    with pytest.raises(PatchError, match="several places"):
+        apply_search_replace(content, [(search, "")])
+
+
+def test_no_match():
+    with pytest.raises(PatchError, match="does not match"):
+        apply_search_replace(SCRIPT, [("class Model:\n    pass\n\n", "")])
+
+
+def test_validate_python():
+    validate_python(SCRIPT)
+    with pytest.raises(PatchError, match="not valid Python"):
+        validate_python("def f(:\n")
+
+
+def test_long_block_with_one_differing_line():
+    content = "".join(f"def step_{i}(x):\n    y = transform(x, {i})\n    return y + {i}\n\n" for i in range(100))
+    lines = content.splitlines(keepends=True)
+    for start, n in [(40, 20), (100, 60), (150, 120)]:
+        block = lines[start:start+n]
+        block[n // 2] = block[n // 2].replace("transform", "transfrom")
+        new = apply_search_replace(content, [("".join(block), "# replaced\n")])
+        assert new == "".join(lines[:start] + ["# replaced\n"] + lines[start+n:])
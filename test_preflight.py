@@ -0,0 +1,52 @@
+import sys
+
+from MLAgentBench.preflight import check_files, uses_current_interpreter
+
+
+def check(code, **files):
+    return check_files({"src/main.py": code, **files}, "/nonexistent", "src/main.py")
+
+
+def test_clean_script():
+    assert check("import os\nimport json.decoder\nprint(os.getcwd())\n") == ""
+
+
+def test_syntax_error():
+    errors = check("def f(:\n    pass\n")
+    assert "SyntaxError" in errors and "main.py" in errors
+
+
+def test_missing_module():
+    errors = check("import os\nimport no_such_module_xyz\n")
+    assert "ModuleNotFoundError: No module named 'no_such_module_xyz'" in errors and "line 2" in errors
+
+
+def test_local_modules_resolve():
+    assert check("import helpers\nfrom helpers.io import load\n", **{"src/helpers/io.py": "def load(): pass\n"}) == ""
+    assert check("import utils\n", **{"src/utils.py": ""}) == ""
+
+
+def test_guarded_imports_are_skipped():
+    assert check("try:\n    import no_such_module_xyz\nexcept ImportError:\n    pass\n") == ""
+    assert check("try:\n    import no_such_module_xyz\nexcept:\n    pass\n") == ""
+    assert check("try:\n    import no_such_module_xyz\nexcept ValueError:\n    pass\n") != ""
+
+
+def test_type_checking_imports_are_skipped():
+    assert check("from typing import TYPE_CHECKING\nif TYPE_CHECKING:\n    import no_such_module_xyz\n") == ""
+    assert check("import typing\nif typing.TYPE_CHECKING:\n    import no_such_module_xyz\nelse:\n    import os\n") == ""
+
+
+def test_imports_in_functions_only_warn(capsys):
+    assert check("def f():\n    import no_such_module_xyz\n") == ""
+    assert "no_such_module_xyz" in capsys.readouterr().out
+    assert check("class A:\n    import no_such_module_xyz\n") != ""
+
+
+def test_imports_not_checked():
+    assert check_files({"main.py": "import no_such_module_xyz\n"}, "/nonexistent", "main.py", check_imports=False) == ""
+
+
+def test_uses_current_interpreter():
+    assert uses_current_interpreter(sys.executable)
+    assert not uses_current_interpreter("/nonexistent/python")
@@ -0,0 +1,68 @@
+import os
+
+from MLAgentBench.snapshot import SnapshotStore
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_snapshot_and_materialize(tmp_path):
+    work_dir = str(tmp_path / "workspace")
+    write(os.path.join(work_dir, "train.py"), "print(1)\n")
+    write(os.path.join(work_dir, "src", "model.py"), "x = 1\n")
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    manifest = store.snapshot(work_dir, 0)
+    # paths are relative to work_dir as the environment lists them: "./train.py", "src/model.py"
+    assert sorted(manifest["files"]) == ["./train.py", "src/model.py"]
+    assert store.has(0) and not store.has(1)
+
+    write(os.path.join(work_dir, "train.py"), "print(2)\n")
+    store.snapshot(work_dir, 1)
+    dest = str(tmp_path / "restored")
+    store.materialize(0, dest)
+    with open(os.path.join(dest, "train.py")) as f:
+        assert f.read() == "print(1)\n"
+    with open(os.path.join(dest, "src", "model.py")) as f:
+        assert f.read() == "x = 1\n"
+
+
+def test_identical_contents_are_stored_once(tmp_path):
+    work_dir = str(tmp_path / "workspace")
+    write(os.path.join(work_dir, "a.py"), "same\n")
+    write(os.path.join(work_dir, "b.py"), "same\n")
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    for step in range(3):
+        manifest = store.snapshot(work_dir, step)
+    assert manifest["files"]["./a.py"]["sha"] == manifest["files"]["./b.py"]["sha"]
+    blobs = [f for _, _, files in os.walk(os.path.join(store.root, "blobs")) for f in files]
+    assert len(blobs) == 1
+
+
+def test_include_filter(tmp_path):
+    work_dir = str(tmp_path / "workspace")
+    write(os.path.join(work_dir, "train.py"), "")
+    write(os.path.join(work_dir, "data.csv"), "a,b\n")
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    manifest = store.snapshot(work_dir, 0, include=lambda path: path != "./data.csv")
+    assert list(manifest["files"]) == ["./train.py"]
+
+
+def test_tree_is_browsable_and_store_is_read_only(tmp_path):
+    work_dir = str(tmp_path / "workspace")
+    write(os.path.join(work_dir, "train.py"), "print(1)\n")
+    store = SnapshotStore(str(tmp_path / "snapshots"), tree_root=str(tmp_path / "traces"))
+    manifest = store.snapshot(work_dir, 0)
+    tree_file = str(tmp_path / "traces" / "step_0_files" / "train.py")
+    with open(tree_file) as f:
+        assert f.read() == "print(1)\n"
+    assert not os.access(store._blob_path(manifest["files"]["./train.py"]["sha"]), os.W_OK) or os.geteuid() == 0
+
+    # a restored workspace can be edited without touching the store
+    dest = str(tmp_path / "restored")
+    store.materialize(0, dest)
+    write(os.path.join(dest, "train.py"), "changed\n")
+    with open(tree_file) as f:
+        assert f.read() == "print(1)\n"
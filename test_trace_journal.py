@@ -0,0 +1,99 @@
+import json
+
+from MLAgentBench.schema import Action, Step, Trace, EnhancedJSONEncoder
+from MLAgentBench.trace_journal import TraceJournal, iter_records, read_trace, compact
+
+
+def make_trace():
+    return Trace(steps=[], low_level_steps=[], action_infos={}, task_description="task")
+
+
+def add_step(trace, i):
+    trace.low_level_steps.append(Step(Action("Read File", {"file_name": f"{i}.py"}), f"content {i}", i + 0.5))
+    trace.steps.append(Step(Action("Understand File", {"file_name": f"{i}.py"}), f"summary {i}", i + 1.0))
+
+
+def test_sync_appends_new_records(tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    trace = make_trace()
+    journal = TraceJournal(path)
+    journal.sync(trace)
+    add_step(trace, 0)
+    journal.sync(trace)
+    journal.sync(trace)
+    add_step(trace, 1)
+    journal.sync(trace)
+    journal.close()
+    assert [r["type"] for r in iter_records(path)] == ["header", "low_level_step", "step", "low_level_step", "step"]
+
+
+def test_sync_after_close_appends(tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    trace = make_trace()
+    journal = TraceJournal(path)
+    add_step(trace, 0)
+    journal.sync(trace)
+    journal.close()
+    add_step(trace, 1)
+    journal.sync(trace)
+    journal.close()
+    assert [r["type"] for r in iter_records(path)] == ["header", "low_level_step", "step", "low_level_step", "step"]
+
+
+def test_read_trace(tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    trace = make_trace()
+    journal = TraceJournal(path)
+    for i in range(3):
+        add_step(trace, i)
+    journal.sync(trace)
+    journal.close()
+
+    restored = read_trace(path, {}, "task")
+    assert restored.steps == trace.steps and restored.low_level_steps == trace.low_level_steps
+    restored = read_trace(path, {}, "task", last_step=1)
+    assert restored.steps == trace.steps[:2] and restored.low_level_steps == trace.low_level_steps[:2]
+
+
+def test_truncated_last_record_is_skipped(tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    trace = make_trace()
+    journal = TraceJournal(path)
+    add_step(trace, 0)
+    journal.sync(trace)
+    journal.close()
+    with open(path, "a") as f:
+        f.write('{"type": "step", "st')
+    assert len(read_trace(path, {}, "task").steps) == 1
+
+
+def test_compact_matches_trace_json(tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    trace = make_trace()
+    journal = TraceJournal(path)
+    for i in range(2):
+        add_step(trace, i)
+    trace.steps.append(Step(Action("Final Answer", {"final_answer": "done"}), "end", 10.0, usage={"max_rss_mb": 1.5}))
+    journal.sync(trace)
+    journal.close()
+    compact(path, str(tmp_path / "trace.json"))
+    with open(tmp_path / "trace.json") as f:
+        assert f.read() == json.dumps(trace, indent=4, cls=EnhancedJSONEncoder)
+
+
+def test_compact_empty_trace(tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    trace = make_trace()
+    journal = TraceJournal(path)
+    journal.sync(trace)
+    journal.close()
+    compact(path, str(tmp_path / "trace.json"))
+    with open(tmp_path / "trace.json") as f:
+        assert f.read() == json.dumps(trace, indent=4, cls=EnhancedJSONEncoder)
+
+
+def test_unset_usage_is_left_out():
+    without = json.loads(json.dumps(Step(Action("Read File", {}), "x", 1.0), cls=EnhancedJSONEncoder))
+    assert without == {"action": {"name": "Read File", "args": {}}, "observation": "x", "timestamp": 1.0}
+    with_usage = json.loads(json.dumps(Step(Action("Execute Script", {}), "x", 1.0, usage={"wall_time": 1.0}), cls=EnhancedJSONEncoder))
+    assert with_usage["usage"] == {"wall_time": 1.0}
@@ -0,0 +1,119 @@
+""" This file contains the append-only journal that the environment writes its trace to, and the compactor that turns
+the journal into the legacy trace.json. """
+
+import os
+import json
+from dacite import from_dict
+
+from .schema import Step, Trace, EnhancedJSONEncoder
+
+TRACE_JOURNAL_FSYNC = "step" # "always": fsync after every record; "step": after each environment step; "never": leave it to the OS
+
+
+class TraceJournal:
+    """ A trace as JSON lines: a header record with the task description and action infos, then one record per step and
+    per low-level step in the order they were recorded. Records are only ever appended, so saving a step costs the size
+    of that step and a crash can at worst leave a truncated last line, which readers skip. """
+
+    def __init__(self, path, fsync=None):
+        self.path = path
+        self.fsync = fsync or TRACE_JOURNAL_FSYNC
+        self._file = None
+        self._started = False
+        self._num_steps = 0
+        self._num_low_level_steps = 0
+
+    def _write(self, record):
+        if self._file is None:
+            # a new journal per environment, like the trace.json it replaces; after close() it is appended to
+            self._file = open(self.path, "a" if self._started else "w")
+            self._started = True
+        self._file.write(json.dumps(record, cls=EnhancedJSONEncoder) + "\n")
+        if self.fsync == "always":
+            self._flush()
+
+    def _flush(self):
+        self._file.flush()
+        if self.fsync != "never":
+            os.fsync(self._file.fileno())
+
+    def sync(self, trace):
+        """ Append the steps and low-level steps of trace that are not in the journal yet. """
+        if not self._started:
+            self._write({"type": "header", "task_description": trace.task_description, "action_infos": trace.action_infos})
+        # low-level steps are recorded while their step runs, so they go first
+        for step in trace.low_level_steps[self._num_low_level_steps:]:
+            self._write({"type": "low_level_step", "step": step})
+        for step in trace.steps[self._num_steps:]:
+            self._write({"type": "step", "step": step})
+        self._num_low_level_steps = len(trace.low_level_steps)
+        self._num_steps = len(trace.steps)
+        if self._file is not None:
+            self._flush()
+
+    def close(self):
+        """ Close the file; a later sync() reopens it for appending. """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def iter_records(path):
+    """ Stream the records of a journal, stopping at a truncated last line. """
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                if line.endswith("\n"):
+                    raise
+                print(f"Warning: ignoring a truncated record at the end of {path}")
+                return
+
+
+def read_trace(path, action_infos, task_description, last_step=None, observations=None):
+    """ Rebuild a Trace from a journal with the given action_infos, task_description (which hold functions and are
+    not restored from disk) and observation store. Only steps up to last_step, and the low-level steps taken before it, are read. """
+    steps = []
+    low_level_steps = []
+    for record in iter_records(path):
+        if record["type"] == "step":
+            steps.append(from_dict(data_class=Step, data=record["step"]))
+            if last_step is not None and len(steps) > last_step:
+                break
+        elif record["type"] == "low_level_step":
+            low_level_steps.append(from_dict(data_class=Step, data=record["step"]))
+    if last_step is not None and steps:
+        t = steps[-1].timestamp
+        low_level_steps = [s for s in low_level_steps if s.timestamp < t]
+    return Trace(steps=steps, low_level_steps=low_level_steps, action_infos=action_infos, task_description=task_description, observations=observations)
+
+
+def _write_array(f, name, records, record_type):
+    f.write(f'    "{name}": [')
+    first = True
+    for record in records:
+        if record["type"] != record_type:
+            continue
+        f.write("\n" if first else ",\n")
+        f.write("\n".join(" " * 8 + line for line in json.dumps(record["step"], indent=4).split("\n")))
+        first = False
+    f.write("\n    ]" if not first else "]")
+
+
+def compact(path, out_path):
+    """ Write the journal at path as the legacy trace.json (the dump of a Trace with indent=4) at out_path. The journal
+    is streamed once per section, so memory use does not grow with the length of the run. """
+    header = next(iter_records(path))
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write("{\n")
+        _write_array(f, "steps", iter_records(path), "step")
+        f.write(",\n")
+        _write_array(f, "low_level_steps", iter_records(path), "low_level_step")
+        f.write(",\n")
+        action_infos = json.dumps(header["action_infos"], indent=4).split("\n")
+        f.write('    "action_infos": ' + "\n".join([action_infos[0]] + ["    " + line for line in action_infos[1:]]) + ",\n")
+        f.write(f'    "task_description": {json.dumps(header["task_description"])}\n')
+        f.write("}")
+    os.replace(tmp_path, out_path)
@@ -0,0 +1,142 @@
+""" This file contains the nearest-neighbour indexes used by the retrieval database over normalized case embeddings. """
+
+import time
+import numpy as np
+
+
+def _topk(scores, k):
+    """ Return (scores, indices) of the k largest entries of each row of scores, sorted in descending order. """
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=scores.dtype), np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        indices = np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+    top = np.take_along_axis(scores, indices, axis=1)
+    order = np.argsort(-top, axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(indices, order, axis=1).astype(np.int64)
+
+
+def _normalize(x):
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+class ExactIndex:
+    """ Brute-force inner product search over every embedding. """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    def search(self, queries, k):
+        """ Return (scores, indices) arrays of shape (len(queries), min(k, len(self))). """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        return _topk(np.asarray(queries @ self.embeddings.T), k)
+
+
+class IVFIndex:
+    """ Inverted file index: embeddings are clustered with spherical k-means into nlist lists, and a query
+    is only compared against the members of its nprobe closest lists. Raising nprobe trades latency for recall;
+    nprobe == nlist is exact search.
+
+    Rows of the result that could not be filled (fewer than k candidates in the probed lists) have index -1 and score -inf.
+    """
+
+    def __init__(self, embeddings, nlist=None, nprobe=8, n_iter=10, train_size=65536, seed=0):
+        x = np.asarray(embeddings, dtype=np.float32)
+        n = x.shape[0]
+        self.nlist = max(1, min(nlist or int(np.sqrt(n)), n))
+        self.nprobe = nprobe
+
+        rng = np.random.default_rng(seed)
+        sample = x[np.sort(rng.choice(n, min(n, max(train_size, self.nlist)), replace=False))]
+        centroids = sample[rng.choice(len(sample), self.nlist, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = np.bincount(assign, minlength=self.nlist) == 0
+            sums[empty] = centroids[empty]
+            centroids = _normalize(sums)
+        self.centroids = centroids
+
+        assign = np.concatenate([
+            np.argmax(x[i:i + 8192] @ centroids.T, axis=1) for i in range(0, n, 8192)
+        ]) if n else np.empty(0, dtype=np.int64)
+        order = np.argsort(assign, kind="stable")
+        self.ids = order.astype(np.int64)
+        self.offsets = np.searchsorted(assign[order], np.arange(self.nlist + 1))
+        # Members of each list are stored contiguously so that probing a list is a single slice.
+        self.vectors = np.ascontiguousarray(x[order])
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def search(self, queries, k, nprobe=None):
+        """ Return (scores, indices) arrays of shape (len(queries), min(k, len(self))). """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(self))
+        _, probes = _topk(queries @ self.centroids.T, min(nprobe or self.nprobe, self.nlist))
+
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, (query, probe) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probe])
+            if len(candidates) == 0:
+                continue
+            top_scores, top = _topk((self.vectors[candidates] @ query)[None, :], k)
+            scores[row, :top.shape[1]] = top_scores[0]
+            indices[row, :top.shape[1]] = self.ids[candidates[top[0]]]
+        return scores, indices
+
+
+INDEX_BACKENDS = {
+    "exact": ExactIndex,
+    "ivf": IVFIndex,
+}
+
+def build_index(embeddings, backend="exact", **params):
+    """ Build a nearest-neighbour index of the given backend over normalized embeddings. """
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown index backend {backend}; choose one of {', '.join(INDEX_BACKENDS)}")
+    return INDEX_BACKENDS[backend](embeddings, **params)
+
+
+def recall_at_k(exact_index, approx_index, queries, k):
+    """ Fraction of the exact top-k neighbours that approx_index also returns in its top-k. """
+    _, exact = exact_index.search(queries, k)
+    _, approx = approx_index.search(queries, k)
+    hits = sum(len(set(e.tolist()) & set(a.tolist())) for e, a in zip(exact, approx))
+    return hits / exact.size
+
+
+def benchmark(num_cases=200000, dim=768, num_queries=200, k=5, nprobes=(1, 4, 8, 16, 32), seed=0):
+    """ Compare recall@k and per-query latency of the IVF backend against exact search on synthetic clustered embeddings. """
+    rng = np.random.default_rng(seed)
+    centers = _normalize(rng.standard_normal((1024, dim)).astype(np.float32))
+    embeddings = _normalize(centers[rng.integers(0, 1024, num_cases)] + rng.standard_normal((num_cases, dim)).astype(np.float32) / np.sqrt(dim))
+    queries = _normalize(centers[rng.integers(0, 1024, num_queries)] + rng.standard_normal((num_queries, dim)).astype(np.float32) / np.sqrt(dim))
+
+    exact = ExactIndex(embeddings)
+    start = time.time()
+    for q in queries:
+        exact.search(q, k)
+    print(f"exact: recall@{k}=1.000 latency={(time.time() - start) / num_queries * 1000:.2f}ms/query")
+
+    start = time.time()
+    ivf = IVFIndex(embeddings)
+    print(f"ivf: built {ivf.nlist} lists in {time.time() - start:.1f}s")
+    for nprobe in nprobes:
+        ivf.nprobe = nprobe
+        start = time.time()
+        for q in queries:
+            ivf.search(q, k)
+        latency = (time.time() - start) / num_queries * 1000
+        print(f"ivf nprobe={nprobe}: recall@{k}={recall_at_k(exact, ivf, queries, k):.3f} latency={latency:.2f}ms/query")
+
+
+if __name__ == "__main__":
+    benchmark()
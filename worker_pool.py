@@ -0,0 +1,278 @@
+""" This file contains an opt-in pool of pre-warmed interpreters that run scripts in forked children, so that heavy
+imports (pandas, sklearn, torch, ...) are paid once per pool rather than once per execute_script.
+
+The server side is started as a standalone script by the interpreter that runs the experiments, so this file only uses
+the standard library and no package-relative imports. Run it directly to benchmark cold and warm script startup. """
+
+import os
+import sys
+import json
+import time
+import atexit
+import runpy
+import signal
+import socket
+import shutil
+import resource
+import tempfile
+import argparse
+import importlib
+import importlib.util
+import selectors
+import threading
+import traceback
+import subprocess
+from types import SimpleNamespace
+
+PRELOAD_MODULES = ["numpy", "pandas", "sklearn", "lightgbm", "torch"]
+
+
+def _run_child(request, fds):
+    """ Body of a forked worker: become a session leader, take over the client's pipes and run the script as __main__. """
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(fds[0], 1)
+    os.dup2(fds[1], 2)
+    for fd in (devnull, *fds):
+        os.close(fd)
+    for limit, soft, hard in request.get("rlimits", []):
+        resource.setrlimit(limit, (soft, hard))
+    os.environ.update(request.get("env") or {})
+    os.chdir(request["cwd"])
+
+    script = request["script"]
+    sys.argv = [script] + request.get("args", [])
+    sys.path.insert(0, os.path.dirname(script))
+    code = 0
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException as e:
+        # hide the frames of this module and runpy, as a fresh interpreter would
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != script:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb)
+        code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except Exception:
+            pass
+    os._exit(code)
+
+
+def serve(socket_path, preload):
+    """ Import the preload modules, then fork a child for every request received on socket_path until the parent exits.
+
+    A request is one JSON message (script, cwd, args, env, rlimits) sent with the stdout and stderr pipe ends attached.
+    The reply is a line with the child's pid, then, once the child has exited, a line with its wait status and rusage. """
+    parent = os.getppid()
+    # this file's directory is on sys.path when run as a script; keep its modules from shadowing the preloads
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path = [p for p in sys.path if os.path.abspath(p or ".") != here]
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            print(f"Warning: worker pool could not preload {name}: {e}", file=sys.stderr)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(64)
+    print("ready", flush=True)
+
+    # SIGCHLD wakes the selector up through this pipe, so exits are reported without polling
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.set_wakeup_fd(wakeup_w)
+
+    children = {}
+    with selectors.DefaultSelector() as selector:
+        selector.register(server, selectors.EVENT_READ)
+        selector.register(wakeup_r, selectors.EVENT_READ)
+        while os.getppid() == parent:
+            for key, _ in selector.select(timeout=1):
+                if key.fileobj == wakeup_r:
+                    while True:
+                        try:
+                            if not os.read(wakeup_r, 4096):
+                                break
+                        except BlockingIOError:
+                            break
+                    continue
+                conn, _ = server.accept()
+                message, fds, _, _ = socket.recv_fds(conn, 1 << 20, 2)
+                if not message or len(fds) != 2:
+                    for fd in fds:
+                        os.close(fd)
+                    conn.close()
+                    continue
+                pid = os.fork()
+                if pid == 0:
+                    signal.set_wakeup_fd(-1)
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    os.close(wakeup_r)
+                    os.close(wakeup_w)
+                    server.close()
+                    for other in (conn, *children.values()):
+                        other.close()
+                    _run_child(json.loads(message), fds)
+                for fd in fds:
+                    os.close(fd)
+                conn.sendall(json.dumps({"pid": pid}).encode() + b"\n")
+                children[pid] = conn
+            while children:
+                pid, status, rusage = os.wait4(-1, os.WNOHANG)
+                if pid == 0:
+                    break
+                conn = children.pop(pid)
+                result = {"status": status, "ru_maxrss": rusage.ru_maxrss, "ru_utime": rusage.ru_utime, "ru_stime": rusage.ru_stime}
+                try:
+                    conn.sendall(json.dumps(result).encode() + b"\n")
+                except OSError:
+                    pass
+                conn.close()
+
+
+class PooledProcess:
+    """ A script running in a forked worker. It has the parts of subprocess.Popen used by run_streaming:
+    pid (also its process group), stdout and stderr pipes, returncode, and wait_with_usage() in place of os.wait4. """
+
+    def __init__(self, socket_path, script, cwd, args=(), env=None, rlimits=()):
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        request = {"script": os.path.abspath(script), "cwd": cwd, "args": list(args), "env": env or {}, "rlimits": list(rlimits)}
+        self.conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.conn.connect(socket_path)
+            socket.send_fds(self.conn, [json.dumps(request).encode()], [out_w, err_w])
+        finally:
+            os.close(out_w)
+            os.close(err_w)
+        self.stdout = os.fdopen(out_r, "rb", buffering=0)
+        self.stderr = os.fdopen(err_r, "rb", buffering=0)
+        self._replies = self.conn.makefile("r")
+        self.pid = json.loads(self._replies.readline())["pid"]
+        self.returncode = None
+
+    def wait_with_usage(self):
+        """ Block until the script exits and return (wait status, rusage) as os.wait4 would. """
+        line = self._replies.readline()
+        self._replies.close()
+        self.conn.close()
+        if not line:
+            raise RuntimeError("The worker pool exited before reporting the script's exit status.")
+        result = json.loads(line)
+        self.returncode = os.waitstatus_to_exitcode(result["status"])
+        return result["status"], SimpleNamespace(ru_maxrss=result["ru_maxrss"], ru_utime=result["ru_utime"], ru_stime=result["ru_stime"])
+
+
+class WorkerPool:
+    """ A warm server process of the given interpreter with preload modules imported; spawn() forks a worker per script. """
+
+    def __init__(self, python=sys.executable, preload=PRELOAD_MODULES):
+        self.python = python
+        self.preload = list(preload)
+        self.tmp_dir = tempfile.mkdtemp(prefix="mlagentbench_pool_")
+        self.socket_path = os.path.join(self.tmp_dir, "pool.sock")
+        self.server = subprocess.Popen(
+            [python, os.path.abspath(__file__), "--serve", self.socket_path, "--preload", ",".join(self.preload)],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, text=True,
+        )
+        if self.server.stdout.readline().strip() != "ready":
+            self.close()
+            raise RuntimeError(f"The worker pool for {python} failed to start.")
+
+    def alive(self):
+        return self.server.poll() is None
+
+    def spawn(self, script, cwd, args=(), env=None, rlimits=()):
+        return PooledProcess(self.socket_path, script, cwd, args=args, env=env, rlimits=rlimits)
+
+    def close(self):
+        if self.server.poll() is None:
+            self.server.terminate()
+            try:
+                self.server.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.server.kill()
+        self.server.stdout.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_worker_pool(python=sys.executable, preload=PRELOAD_MODULES):
+    """ Return the shared pool of the given interpreter and preload modules, (re)starting it if needed. """
+    python = shutil.which(python) or python
+    key = (python, tuple(preload))
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None or not pool.alive():
+            if pool is not None:
+                pool.close()
+            pool = _POOLS[key] = WorkerPool(python, preload)
+        return pool
+
+@atexit.register
+def close_worker_pools():
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
+        _POOLS.clear()
+
+
+def benchmark(preload=PRELOAD_MODULES, runs=5):
+    """ Compare the wall time of running a script that imports the preload modules in a fresh interpreter and in the pool. """
+    available = [name for name in preload if importlib.util.find_spec(name) is not None]
+    print(f"preloaded modules: {', '.join(available) or 'none installed'}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        script = os.path.join(tmp_dir, "script.py")
+        with open(script, "w") as f:
+            f.write("".join(f"import {name}\n" for name in available) + "print('done')\n")
+
+        start = time.time()
+        for _ in range(runs):
+            subprocess.run([sys.executable, script], cwd=tmp_dir, capture_output=True, check=True)
+        cold = (time.time() - start) / runs
+        print(f"fresh interpreter: {cold * 1000:.0f}ms/run")
+
+        start = time.time()
+        pool = WorkerPool(sys.executable, available)
+        print(f"pool startup: {(time.time() - start) * 1000:.0f}ms (paid once)")
+        start = time.time()
+        for _ in range(runs):
+            process = pool.spawn(script, tmp_dir)
+            output = process.stdout.read()
+            process.stderr.read()
+            process.stdout.close()
+            process.stderr.close()
+            process.wait_with_usage()
+            assert process.returncode == 0 and output == b"done\n", output
+        warm = (time.time() - start) / runs
+        pool.close()
+        print(f"worker pool: {warm * 1000:.0f}ms/run ({cold / max(warm, 1e-9):.1f}x faster)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--serve", type=str, default=None, help="run the pool server on this unix socket")
+    parser.add_argument("--preload", type=str, default=",".join(PRELOAD_MODULES), help="comma separated modules to import up front")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    preload = [name for name in args.preload.split(",") if name]
+    if args.serve:
+        serve(args.serve, preload)
+    else:
+        benchmark(preload, args.runs)